@@ -0,0 +1,71 @@
+"""
+Асинхронный слой доступа к данным.
+
+Клиент supabase-py синхронный: каждый `.execute()` блокирует поток на время
+сетевого запроса. Чтобы не останавливать цикл событий uvicorn, все вызовы
+выполняются в пуле потоков, а число одновременных запросов к БД ограничено
+`CapacityLimiter`, чтобы всплеск трафика не съедал все потоки процесса.
+
+Клиент создается лениво, при первом запросе: импорт приложения и запуск
+воркера не зависят от сети.
+
+Если передан реестр `metrics`, время каждого вызова учитывается как фаза `db`.
+"""
+import threading
+from typing import Any, Callable, Optional
+
+import anyio
+from supabase import Client
+
+from metrics import Metrics
+
+# Код ошибки PostgreSQL при нарушении ограничения уникальности
+UNIQUE_VIOLATION = '23505'
+
+
+def is_unique_violation(exc: Exception) -> bool:
+    """Проверяет, что запрос отклонен из-за дубликата (например, названия стиха)."""
+    return getattr(exc, 'code', None) == UNIQUE_VIOLATION
+
+
+class AsyncDB:
+    """Обертка над синхронным клиентом Supabase с выгрузкой вызовов в потоки."""
+
+    def __init__(self, client_factory: Callable[[], Client], max_concurrency: int = 16, metrics: Optional[Metrics] = None):
+        self.client_factory = client_factory
+        self.max_concurrency = max_concurrency
+        self.metrics = metrics
+        self._client: Optional[Client] = None
+        self._client_lock = threading.Lock()
+        self._limiter: Optional[anyio.CapacityLimiter] = None
+
+    @property
+    def client(self) -> Client:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self.client_factory()
+        return self._client
+
+    @property
+    def limiter(self) -> anyio.CapacityLimiter:
+        # Лимитер создается лениво, уже внутри запущенного цикла событий
+        if self._limiter is None:
+            self._limiter = anyio.CapacityLimiter(self.max_concurrency)
+        return self._limiter
+
+    def table(self, name: str):
+        """Построение запроса не выполняет I/O, поэтому остается синхронным."""
+        return self.client.table(name)
+
+    async def execute(self, query) -> Any:
+        """Выполняет построенный запрос (`db.table(...).select(...)`) в пуле потоков."""
+        return await self.run(query.execute)
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Выполняет произвольную блокирующую функцию с учетом лимита конкурентности."""
+        if self.metrics is None:
+            return await anyio.to_thread.run_sync(func, *args, limiter=self.limiter)
+        # В замер входит и ожидание свободного слота в лимитере
+        with self.metrics.timer('db'):
+            return await anyio.to_thread.run_sync(func, *args, limiter=self.limiter)
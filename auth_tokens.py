@@ -0,0 +1,66 @@
+"""
+Кэш проверенных JWT.
+
+Браузер присылает один и тот же токен с каждым запросом, а `jwt.decode`
+(разбор base64, JSON и проверка HMAC) каждый раз повторяет одну и ту же
+работу. Кэш хранит claims уже проверенных токенов до их `exp` и вытесняет
+давно не использованные записи (LRU). Ключ — хеш токена, а не сам токен.
+
+Кэшируются только успешно проверенные токены, поэтому мусорные cookie не
+засоряют кэш и каждый раз честно отклоняются через `jwt.decode`.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import jwt
+
+
+def _token_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+class TokenCache:
+    """LRU-кэш claims проверенных токенов с учетом `exp`."""
+
+    def __init__(self, secret_key: str, algorithm: str, max_size: int = 4096):
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify(self, token: str) -> dict:
+        """Возвращает claims токена или бросает `jwt.PyJWTError`."""
+        key = _token_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                claims, expires_at = entry
+                if expires_at is not None and time.time() >= expires_at:
+                    del self._entries[key]
+                    raise jwt.ExpiredSignatureError("Signature has expired")
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(claims)
+            self.misses += 1
+
+        claims = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+        expires_at: Optional[float] = claims.get('exp')
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return dict(claims)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,92 @@
+"""
+Бенчмарк изменяющих эндпоинтов против локальной замены Supabase.
+
+Для каждого эндпоинта печатает среднюю и p95 задержку запроса и число
+обращений к БД на запрос. Задержка одного обращения к "БД" задается
+`--latency`, так что разница в числе round-trip'ов сразу видна во времени.
+
+Запуск из корня репозитория (нужен httpx для fastapi.testclient):
+
+    python benchmarks/bench_mutations.py --latency 0.02 --iterations 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_supabase import FakeSupabase
+
+
+def load_app(client: FakeSupabase):
+    """Импортирует приложение, подменив создание клиента Supabase на локальный."""
+    os.chdir(ROOT)
+    os.environ.setdefault("SUPABASE_URL", "http://localhost")
+    os.environ.setdefault("SUPABASE_KEY", "benchmark")
+    import supabase
+    supabase.create_client = lambda *args, **kwargs: client
+    import main
+    return main
+
+
+def wait_for_bootstrap(app_module, timeout: float = 30.0) -> None:
+    """Ждет фоновую инициализацию (создание админа), запущенную lifespan'ом."""
+    deadline = time.monotonic() + timeout
+    while app_module.bootstrap.status in ('pending', 'running') and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def measure(http, client: FakeSupabase, name: str, requests):
+    timings, calls = [], []
+    for method, url, body in requests:
+        calls_before = client.calls
+        started = time.perf_counter()
+        response = http.request(method, url, json=body)
+        timings.append(time.perf_counter() - started)
+        calls.append(client.calls - calls_before)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name}: {url} -> {response.status_code} {response.text}")
+    timings.sort()
+    print(f"{name:<14} {statistics.mean(timings) * 1000:9.2f} {timings[int(len(timings) * 0.95) - 1] * 1000:9.2f} {statistics.mean(calls):9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.01, help="задержка одного запроса к БД, секунды")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--poems", type=int, default=200)
+    args = parser.parse_args()
+
+    client = FakeSupabase()
+    app_module = load_app(client)
+    client.table('poem').insert([
+        {'title': f'Стих {i}', 'author': f'Автор {i % 10}', 'text': 'строка\\nстрока'} for i in range(args.poems)
+    ]).execute()
+
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_module.app) as http:
+        wait_for_bootstrap(app_module)
+        http.post('/login', data={'username': 'admin', 'password': 'zynqochka'}, follow_redirects=False)
+        http.get('/')
+        client.latency = args.latency
+
+        n = args.iterations
+        print(f"latency={args.latency * 1000:.1f}ms iterations={n} poems={args.poems}")
+        print(f"{'endpoint':<14} {'mean ms':>9} {'p95 ms':>9} {'db calls':>9}")
+        measure(http, client, 'toggle_read', [('POST', '/toggle_read', {'title': f'Стих {i % args.poems}'}) for i in range(n)])
+        measure(http, client, 'toggle_pin', [('POST', '/toggle_pin', {'title': f'Стих {i % args.poems}'}) for i in range(n)])
+        measure(http, client, 'add_poem', [
+            ('POST', '/add_poem', {'title': f'Новый {i}', 'author': 'Автор', 'text': 'текст'}) for i in range(n)
+        ])
+        measure(http, client, 'edit_poem', [
+            ('POST', f'/edit_poem/Новый {i}', {'title': f'Новый {i}', 'author': 'Автор', 'text': 'новый текст'}) for i in range(n)
+        ])
+        measure(http, client, 'delete_poem', [('POST', f'/delete_poem/Новый {i}', None) for i in range(n)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Бенчмарк поиска: инвертированный индекс против линейного прохода.
+
+Генерирует синтетический каталог из "русских" слов и сравнивает среднее
+время запроса в `SearchIndex` с подстрочным поиском по всем стихам (так
+раньше искал браузер в `filterAndRender`). Отдельно меряются запросы,
+которые набирают по буквам: префиксы из 1-3 символов, в том числе после
+целого слова. Кэш результатов индекса перед каждым запросом сбрасывается.
+
+    python benchmarks/bench_search.py --poems 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex
+
+SYLLABLES = ['ла', 'ро', 'ми', 'ве', 'на', 'ст', 'лю', 'бо', 'зе', 'ка', 'пу', 'ш', 'ть', 'гр', 'до', 'сн']
+ENDINGS = ['', 'а', 'ой', 'ами', 'ого', 'ет', 'ть', 'ые', 'ью']
+
+
+def make_vocabulary(size: int, rng: random.Random):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_poems(count: int, vocabulary, rng: random.Random):
+    for i in range(count):
+        lines = [' '.join(rng.choice(vocabulary) + rng.choice(ENDINGS) for _ in range(6)) for _ in range(rng.randint(4, 12))]
+        yield {
+            'title': f'{rng.choice(vocabulary).capitalize()} {i}',
+            'author': f'Автор {rng.choice(vocabulary)}',
+            'text': '\n'.join(lines),
+        }
+
+
+def timed(func, queries, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            func(query)
+    return (time.perf_counter() - started) / (repeat * len(queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--poems", type=int, default=100_000)
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    poems = list(make_poems(args.poems, vocabulary, rng))
+
+    index = SearchIndex()
+    started = time.perf_counter()
+    index.sync(poems)
+    build_seconds = time.perf_counter() - started
+
+    haystacks = ['\n'.join((p['title'], p['author'], p['text'])).casefold() for p in poems]
+    queries = [rng.choice(vocabulary) for _ in range(args.queries)]
+    queries += [f'{rng.choice(vocabulary)} {rng.choice(vocabulary)}' for _ in range(args.queries)]
+
+    def uncached(query):
+        index._results.clear()
+        return index.scores(query)
+
+    indexed = timed(uncached, queries, repeat=3)
+    linear = timed(lambda q: [h for h in haystacks if all(w in h for w in q.split())], queries[:20], repeat=1)
+
+    single = timed(uncached, queries[:args.queries], repeat=3)
+    double = timed(uncached, queries[args.queries:], repeat=3)
+    print(f"poems={args.poems} terms={len(index._postings)} build={build_seconds:.2f}s")
+    print(f"index:  {indexed * 1000:8.3f} ms/query (1 word {single * 1000:.3f} ms, 2 words {double * 1000:.3f} ms)")
+    print(f"linear: {linear * 1000:8.3f} ms/query")
+    print(f"speedup: {linear / indexed:.0f}x")
+
+    for length in (1, 2, 3):
+        prefixes = [rng.choice(vocabulary)[:length] for _ in range(args.queries)]
+        alone = timed(uncached, prefixes, repeat=1)
+        after_word = timed(uncached, [f'{rng.choice(vocabulary)} {p}' for p in prefixes], repeat=1)
+        print(f"prefix {length}: {alone * 1000:8.3f} ms/query, after a word {after_word * 1000:.3f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Локальная замена клиента Supabase для бенчмарков.
+
+Реализует используемое приложением подмножество построителя запросов
+supabase-py (`table().select().eq().execute()`, insert/upsert/update/delete,
+range/order/limit) поверх словарей в памяти. Ограничения уникальности
+и каскады внешних ключей повторяют схему БД, ошибки выбрасываются как
+`postgrest.APIError` с теми же кодами, что возвращает PostgREST.
+
+Каждый `execute()` засыпает на `latency` секунд, имитируя сетевой запрос,
+и увеличивает счетчик `calls`.
+"""
+import copy
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from postgrest import APIError
+
+# Первичные/уникальные ключи таблиц приложения
+UNIQUE_KEYS = {
+    'user': ('username',),
+    'poem': ('title',),
+    'poem_read': ('username', 'poem_title'),
+}
+
+# Внешние ключи с `on update cascade on delete cascade`: (таблица, колонка) -> (таблица, колонка)
+FOREIGN_KEYS = {
+    ('poem_read', 'username'): ('user', 'username'),
+    ('poem_read', 'poem_title'): ('poem', 'title'),
+}
+
+# Значения по умолчанию, которые в Supabase проставляет сама БД
+DEFAULTS = {
+    'user': {'is_admin': False, 'show_all_tab': False, 'user_data': '', 'pinned_poem_title': None, 'read_poems_json': []},
+}
+
+
+class FakeQuery:
+    def __init__(self, client: "FakeSupabase", table: str):
+        self.client = client
+        self.table_name = table
+        self.op = 'select'
+        self.columns = '*'
+        self.payload = None
+        self.filters = []
+        self.options = {}
+        self._order = None
+        self._range = None
+        self._limit = None
+
+    # --- построение запроса ---
+
+    def select(self, *columns, **kwargs):
+        self.op, self.columns = 'select', ','.join(columns) or '*'
+        self.options = kwargs
+        return self
+
+    def insert(self, json, **kwargs):
+        self.op, self.payload, self.options = 'insert', json, kwargs
+        return self
+
+    def upsert(self, json, **kwargs):
+        self.op, self.payload, self.options = 'upsert', json, kwargs
+        return self
+
+    def update(self, json, **kwargs):
+        self.op, self.payload, self.options = 'update', json, kwargs
+        return self
+
+    def delete(self, **kwargs):
+        self.op, self.options = 'delete', kwargs
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda row: row.get(column) != value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def order(self, column, desc=False, **kwargs):
+        self._order = (column, desc)
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def limit(self, size):
+        self._limit = size
+        return self
+
+    # --- выполнение ---
+
+    def execute(self):
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        with self.client.lock:
+            self.client.calls += 1
+            data = getattr(self, '_' + self.op)(self.client.tables.setdefault(self.table_name, []))
+        count = len(data) if self.options.get('count') else None
+        return SimpleNamespace(data=data, count=count)
+
+    def _matching(self, rows: List[dict]) -> List[dict]:
+        return [row for row in rows if all(f(row) for f in self.filters)]
+
+    def _project(self, row: dict) -> dict:
+        if self.columns == '*':
+            return copy.deepcopy(row)
+        return {c.strip(): copy.deepcopy(row.get(c.strip())) for c in self.columns.split(',')}
+
+    def _select(self, rows):
+        rows = self._matching(rows)
+        if self._order:
+            column, desc = self._order
+            rows.sort(key=lambda row: row.get(column), reverse=desc)
+        if self._range:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        if self.options.get('head'):
+            return []
+        return [self._project(row) for row in rows]
+
+    def _insert(self, rows):
+        result = []
+        for new in self.payload if isinstance(self.payload, list) else [self.payload]:
+            new = {**DEFAULTS.get(self.table_name, {}), **copy.deepcopy(new)}
+            self.client.check_foreign_keys(self.table_name, new)
+            existing = self.client.find_conflict(self.table_name, new, self._conflict_columns())
+            if existing is not None:
+                if self.op == 'insert':
+                    raise APIError({'message': 'duplicate key value violates unique constraint', 'code': '23505', 'hint': None, 'details': None})
+                if not self.options.get('ignore_duplicates'):
+                    existing.update(new)
+                    result.append(copy.deepcopy(existing))
+                continue
+            if self.table_name == 'poem':
+                self.client.next_id += 1
+                new.setdefault('id', self.client.next_id)
+            rows.append(new)
+            result.append(copy.deepcopy(new))
+        return result
+
+    _upsert = _insert
+
+    def _update(self, rows):
+        result = []
+        for row in self._matching(rows):
+            changed = {**row, **copy.deepcopy(self.payload)}
+            conflict = self.client.find_conflict(self.table_name, changed, None)
+            if conflict is not None and conflict is not row:
+                raise APIError({'message': 'duplicate key value violates unique constraint', 'code': '23505', 'hint': None, 'details': None})
+            self.client.cascade_update(self.table_name, row, changed)
+            row.update(changed)
+            result.append(copy.deepcopy(row))
+        return result
+
+    def _delete(self, rows):
+        removed = self._matching(rows)
+        for row in removed:
+            rows.remove(row)
+            self.client.cascade_delete(self.table_name, row)
+        return [copy.deepcopy(row) for row in removed]
+
+    def _conflict_columns(self):
+        on_conflict = self.options.get('on_conflict')
+        return tuple(c.strip() for c in on_conflict.split(',')) if on_conflict else None
+
+
+class FakeSupabase:
+    """Клиент с тем же интерфейсом `table()`, что и `supabase.Client`."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self.next_id = 0
+        self.tables: Dict[str, List[dict]] = {name: [] for name in UNIQUE_KEYS}
+        self.lock = threading.RLock()
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def find_conflict(self, table: str, row: dict, columns: Optional[tuple]) -> Optional[dict]:
+        key = columns or UNIQUE_KEYS.get(table)
+        if not key:
+            return None
+        for existing in self.tables.get(table, []):
+            if all(existing.get(c) == row.get(c) for c in key):
+                return existing
+        return None
+
+    def check_foreign_keys(self, table: str, row: dict) -> None:
+        for (child, column), (parent, parent_column) in FOREIGN_KEYS.items():
+            if child == table and not any(p.get(parent_column) == row.get(column) for p in self.tables[parent]):
+                raise APIError({'message': 'insert or update violates foreign key constraint', 'code': '23503', 'hint': None, 'details': None})
+
+    def cascade_update(self, table: str, old: dict, new: dict) -> None:
+        for (child, column), (parent, parent_column) in FOREIGN_KEYS.items():
+            if parent == table and old.get(parent_column) != new.get(parent_column):
+                for row in self.tables[child]:
+                    if row.get(column) == old.get(parent_column):
+                        row[column] = new.get(parent_column)
+
+    def cascade_delete(self, table: str, old: dict) -> None:
+        for (child, column), (parent, parent_column) in FOREIGN_KEYS.items():
+            if parent == table:
+                self.tables[child] = [r for r in self.tables[child] if r.get(column) != old.get(parent_column)]
@@ -0,0 +1,228 @@
+"""
+Нагрузочный тест приложения против локальной замены Supabase.
+
+Поднимает приложение в процессе (без сети) поверх `FakeSupabase`, заполняет
+"БД" пользователями и стихами и гоняет смесь запросов из нескольких
+параллельных клиентов: главная для вошедших и анонимов, текст стиха, поиск,
+отметки прочтения и закрепления, вход и редактирование стихов админом.
+Для каждого типа запроса печатает число запросов, ошибки, запросы в секунду
+и задержки p50/p99.
+
+Задержка одного обращения к "БД" задается `--latency`. С `--max-p99-ms`
+скрипт завершается с кодом 1, если p99 любого типа запроса выше порога
+или были ошибки, — так его можно ставить в CI перед деплоем.
+
+Запуск из корня репозитория (нужен httpx):
+
+    python benchmarks/load_test.py --users 200 --poems 2000 --concurrency 32 --duration 15
+    python benchmarks/load_test.py --mix home=70,poem=20,toggle_read=10 --max-p99-ms 250
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_mutations import load_app
+from fake_supabase import FakeSupabase
+
+DEFAULT_MIX = "home=40,anon_home=10,poem=15,search=10,toggle_read=12,toggle_pin=5,login=3,admin_edit=5"
+
+PASSWORD = "load-test"
+ADMIN_USERNAME, ADMIN_PASSWORD = "admin", "zynqochka"
+
+WORDS = ['ночь', 'улица', 'фонарь', 'аптека', 'снег', 'зима', 'любовь', 'море', 'ветер', 'звезда', 'сад', 'осень']
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"Неизвестный тип запроса: {name.strip()} (есть: {', '.join(OPERATIONS)})")
+        mix[name.strip()] = int(weight or 1)
+    return mix
+
+
+def seed(client: FakeSupabase, users: int, poems: int, rng: random.Random) -> None:
+    """Заполняет таблицы напрямую, минуя проверки уникальности по одной строке."""
+    from passwords import pwd_context
+
+    # Один хеш на всех: посев не должен занимать минуты bcrypt
+    password_hash = pwd_context.hash(PASSWORD)
+    client.tables['user'].extend(
+        {'username': f'user{i}', 'password_hash': password_hash, 'is_admin': False, 'show_all_tab': False,
+         'user_data': '', 'pinned_poem_title': None, 'read_poems_json': []}
+        for i in range(users)
+    )
+    for i in range(poems):
+        client.next_id += 1
+        lines = [' '.join(rng.choice(WORDS) for _ in range(5)) for _ in range(rng.randint(4, 16))]
+        client.tables['poem'].append({
+            'id': client.next_id, 'title': f'Стих {i}', 'author': f'Автор {i % 50}', 'text': '\\n'.join(lines),
+        })
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(p * len(sorted_values)) - 1))]
+
+
+async def log_in(http: httpx.AsyncClient, username: str, password: str) -> None:
+    """
+    Вход с повтором: при одновременном входе многих клиентов пул bcrypt
+    отвечает 503, а ограничение частоты — 429.
+    """
+    for _ in range(50):
+        response = await http.post('/login', data={'username': username, 'password': password})
+        if response.status_code == 303:
+            return
+        if response.status_code not in (429, 503):
+            break
+        await asyncio.sleep(float(response.headers.get('retry-after', 1)) / 10)
+    raise RuntimeError(f"Не удалось войти как {username}: {response.status_code}")
+
+
+class VirtualUser:
+    """Вошедший пользователь со своим http-клиентом (и своими cookie)."""
+
+    def __init__(self, http: httpx.AsyncClient, username: str):
+        self.http = http
+        self.username = username
+
+
+# --- Типы запросов: (пользователь, http-клиент админа, анонимный клиент, rng, число стихов) -> ответ ---
+
+async def op_home(user, admin, anon, rng, poems):
+    return await user.http.get('/')
+
+async def op_anon_home(user, admin, anon, rng, poems):
+    return await anon.get('/')
+
+async def op_poem(user, admin, anon, rng, poems):
+    return await user.http.get(f'/api/poem/Стих {rng.randrange(poems)}')
+
+async def op_search(user, admin, anon, rng, poems):
+    params = {'q': rng.choice(WORDS)[:rng.randint(2, 5)], 'filter': rng.choice(['all', 'unread', 'read'])}
+    return await user.http.get('/api/poems/search', params=params)
+
+async def op_toggle_read(user, admin, anon, rng, poems):
+    return await user.http.post('/toggle_read', json={'title': f'Стих {rng.randrange(poems)}'})
+
+async def op_toggle_pin(user, admin, anon, rng, poems):
+    return await user.http.post('/toggle_pin', json={'title': f'Стих {rng.randrange(poems)}'})
+
+async def op_login(user, admin, anon, rng, poems):
+    return await user.http.post('/login', data={'username': user.username, 'password': PASSWORD})
+
+async def op_admin_edit(user, admin, anon, rng, poems):
+    i = rng.randrange(poems)
+    text = '\n'.join(' '.join(rng.choice(WORDS) for _ in range(5)) for _ in range(4))
+    return await admin.post(f'/edit_poem/Стих {i}', json={'title': f'Стих {i}', 'author': f'Автор {i % 50}', 'text': text})
+
+OPERATIONS = {
+    'home': op_home,
+    'anon_home': op_anon_home,
+    'poem': op_poem,
+    'search': op_search,
+    'toggle_read': op_toggle_read,
+    'toggle_pin': op_toggle_pin,
+    'login': op_login,
+    'admin_edit': op_admin_edit,
+}
+
+
+async def run(args) -> int:
+    rng = random.Random(args.seed)
+    client = FakeSupabase()
+    # Все виртуальные клиенты приходят с одного адреса — ограничение частоты
+    # входа превратило бы замер в проверку лимита
+    os.environ.setdefault("AUTH_RATE_PER_MINUTE", "0")
+    app_module = load_app(client)
+    seed(client, args.users, args.poems, rng)
+    app = app_module.app
+
+    def http_client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest", follow_redirects=False)
+
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+
+    async with app.router.lifespan_context(app):
+        while app_module.bootstrap.status in ('pending', 'running'):
+            await asyncio.sleep(0.05)
+        anon = http_client()
+        admin = http_client()
+        await log_in(admin, ADMIN_USERNAME, ADMIN_PASSWORD)
+
+        # Все клиенты входят заранее, чтобы bcrypt при входе не попал в замер
+        users = [VirtualUser(http_client(), f'user{rng.randrange(args.users)}') for _ in range(args.concurrency)]
+        await asyncio.gather(*(log_in(user.http, user.username, PASSWORD) for user in users))
+        # Прогрев: каталог и кэши заполняются до начала замеров
+        await anon.get('/')
+
+        async def worker(user: VirtualUser, worker_rng: random.Random, deadline: float) -> None:
+            while time.perf_counter() < deadline:
+                name = worker_rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                response = await OPERATIONS[name](user, admin, anon, worker_rng, args.poems)
+                latencies[name].append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors[name] += 1
+
+        client.latency = args.latency
+        calls_before = client.calls
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            worker(user, random.Random(args.seed * 1000 + n), started + args.duration) for n, user in enumerate(users)
+        ))
+        elapsed = time.perf_counter() - started
+        db_calls = client.calls - calls_before
+        for http in [anon, admin] + [user.http for user in users]:
+            await http.aclose()
+
+    total = sum(len(v) for v in latencies.values())
+    print(f"users={args.users} poems={args.poems} concurrency={args.concurrency} "
+          f"latency={args.latency * 1000:.1f}ms duration={elapsed:.1f}s")
+    print(f"{'endpoint':<12} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    failed = False
+    for name in names:
+        values = sorted(latencies[name])
+        p99 = percentile(values, 0.99) * 1000
+        print(f"{name:<12} {len(values):>9} {errors[name]:>7} {len(values) / elapsed:>8.1f} "
+              f"{percentile(values, 0.5) * 1000:>8.2f} {p99:>8.2f} {(values[-1] if values else 0) * 1000:>8.2f}")
+        if args.max_p99_ms is not None and (p99 > args.max_p99_ms or errors[name]):
+            failed = True
+    print(f"{'total':<12} {total:>9} {sum(errors.values()):>7} {total / elapsed:>8.1f}   "
+          f"db calls/request {db_calls / max(total, 1):.2f}")
+    if failed:
+        print(f"FAIL: p99 выше {args.max_p99_ms} ms или есть ошибки")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--poems", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16, help="число параллельных клиентов")
+    parser.add_argument("--duration", type=float, default=10.0, help="длительность замера, секунды")
+    parser.add_argument("--latency", type=float, default=0.005, help="задержка одного запроса к БД, секунды")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="веса типов запросов, например home=70,poem=30")
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="порог p99 для каждого типа запроса")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Однократная инициализация данных при запуске воркеров.
+
+gunicorn/uvicorn поднимают несколько воркеров одновременно, и каждый выполняет
+lifespan приложения. Чтобы начальная инициализация (создание администратора)
+не выполнялась всеми воркерами наперегонки, ее выполняет тот, кто первым
+захватил файловую блокировку; остальные пропускают шаг. Между машинами
+защитой служит ограничение уникальности в БД.
+
+Инициализация идет в фоне и не задерживает готовность воркера.
+"""
+import asyncio
+import os
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+
+@contextmanager
+def worker_lock(path: str) -> Iterator[bool]:
+    """Неблокирующая межпроцессная блокировка; отдает True, если она захвачена."""
+    if fcntl is None:
+        yield True
+        return
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class Bootstrap:
+    """Фоновый запуск инициализации с повторами при ошибках (например, БД недоступна)."""
+
+    def __init__(self, lock_path: str, retry_seconds: float = 5.0, max_attempts: int = 10):
+        self.lock_path = lock_path
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+        # pending -> running -> done | skipped | failed
+        self.status = 'pending'
+        self.error: str = ''
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, func: Callable[[], Awaitable[None]]) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run(func))
+
+    async def _run(self, func: Callable[[], Awaitable[None]]) -> None:
+        with worker_lock(self.lock_path) as acquired:
+            if not acquired:
+                self.status = 'skipped'
+                return
+            self.status = 'running'
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    await func()
+                    self.status = 'done'
+                    return
+                except Exception as e:
+                    self.error = str(e)
+                    print(f"Ошибка инициализации (попытка {attempt}): {e}")
+                    if attempt < self.max_attempts:
+                        await asyncio.sleep(self.retry_seconds)
+            self.status = 'failed'
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        return {"status": self.status, "error": self.error, "pid": os.getpid()}
@@ -0,0 +1,122 @@
+"""
+Потоковый разбор и формирование файлов для массового импорта/экспорта стихов.
+
+Поддерживаются NDJSON (один JSON-объект на строку) и CSV с заголовком
+`title,author,text`. Тело запроса читается по частям, поэтому память не
+зависит от размера файла.
+"""
+import codecs
+import csv
+import io
+import json
+from typing import AsyncIterator, List, Optional, Tuple
+
+EXPORT_FIELDS = ('title', 'author', 'text')
+
+# Максимальная длина одной записи CSV, символов: длиннее — скорее всего
+# незакрытая кавычка, которая иначе склеила бы в одну запись весь файл
+MAX_CSV_RECORD_SIZE = 1024 * 1024
+
+# (номер строки, запись или None, ошибка или None)
+ParsedRecord = Tuple[int, Optional[dict], Optional[str]]
+
+
+async def read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Режет поток байтов на строки UTF-8 (с сохранением перевода строки)."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    # Начало незаконченной строки; режется только новый кусок, а не вся строка заново
+    pending: List[str] = []
+    async for chunk in chunks:
+        *lines, rest = decoder.decode(chunk).split('\n')
+        if lines:
+            lines[0] = ''.join(pending) + lines[0]
+            pending = []
+            for line in lines:
+                yield line + '\n'
+        if rest:
+            pending.append(rest)
+    rest = ''.join(pending) + decoder.decode(b'', final=True)
+    if rest:
+        yield rest
+
+
+async def parse_ndjson(lines: AsyncIterator[str]) -> AsyncIterator[ParsedRecord]:
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, None, f"Некорректный JSON: {e.msg}"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "Ожидался JSON-объект"
+            continue
+        yield line_no, record, None
+
+
+async def parse_csv(lines: AsyncIterator[str], max_record_size: int = MAX_CSV_RECORD_SIZE) -> AsyncIterator[ParsedRecord]:
+    """
+    Разбирает CSV с заголовком. Поле в кавычках может занимать несколько строк
+    (текст стиха), поэтому строки копятся, пока число кавычек не станет четным.
+    Четность считается по каждой новой строке. Запись длиннее `max_record_size`
+    символов отбрасывается с ошибкой вместе со всеми строками до той, на
+    которой кавычки снова сходятся.
+    """
+    header = None
+    parts: List[str] = []
+    size = 0
+    in_quotes = False
+    oversized = False
+    line_no = 0
+    record_line = 1
+    async for line in lines:
+        line_no += 1
+        if not parts and not oversized:
+            record_line = line_no
+        if line.count('"') % 2:
+            in_quotes = not in_quotes
+        if not oversized:
+            parts.append(line)
+            size += len(line)
+            if size > max_record_size:
+                yield record_line, None, f"Запись длиннее {max_record_size} символов (незакрытая кавычка?)"
+                parts, size, oversized = [], 0, True
+        if in_quotes:
+            continue
+        if oversized:
+            oversized = False
+            continue
+        row = next(csv.reader([''.join(parts)]), [])
+        parts, size = [], 0
+        if not any(cell.strip() for cell in row):
+            continue
+        if header is None:
+            header = [cell.strip().lower() for cell in row]
+            continue
+        if len(row) != len(header):
+            yield record_line, None, f"Ожидалось {len(header)} колонок, получено {len(row)}"
+            continue
+        yield record_line, dict(zip(header, row)), None
+    if parts:
+        yield record_line, None, "Незакрытая кавычка в конце файла"
+
+
+def ndjson_line(poem: dict) -> str:
+    return json.dumps({field: poem.get(field) for field in EXPORT_FIELDS}, ensure_ascii=False) + '\n'
+
+
+def csv_line(values) -> str:
+    out = io.StringIO()
+    csv.writer(out, lineterminator='\n').writerow(values)
+    return out.getvalue()
+
+
+def csv_header() -> str:
+    return csv_line(EXPORT_FIELDS)
+
+
+def csv_poem_line(poem: dict) -> str:
+    return csv_line([poem.get(field) for field in EXPORT_FIELDS])
@@ -0,0 +1,393 @@
+"""
+Кэш каталога стихов в памяти процесса.
+
+Каталог хранит нормализованный снимок таблицы `poem` (переводы строк уже
+раскрыты, `line_count` посчитан заранее), обновляется по TTL и патчится на месте
+при добавлении, редактировании и удалении стихов через админку.
+
+Загрузка из БД нормализует строки и строит поисковый индекс в отдельном
+потоке, а в цикл событий возвращает готовые снимок и индекс: на 100k стихов
+это секунды работы, которые иначе остановили бы все запросы воркера.
+"""
+import base64
+import bisect
+import hashlib
+import heapq
+import json
+import threading
+import time
+from typing import Awaitable, Callable, Collection, Dict, List, Optional, Set, Tuple
+
+import anyio
+
+from search_index import SearchIndex
+from shared_state import SharedVersions
+from single_flight import SingleFlight
+
+# Поля, по которым можно сортировать выдачу; 'relevance' — только вместе с запросом
+SORT_FIELDS = ('title', 'author', 'line_count', 'relevance')
+
+# Длина превью в сводке стиха, символов
+PREVIEW_LENGTH = 120
+
+# Сколько отсутствующих названий (ответов 404) помнится для одной версии каталога
+MISSING_TITLES_MAX = 4096
+
+
+def normalize_poem(poem: dict) -> dict:
+    """Раскрывает экранированные переводы строк и считает количество строк."""
+    poem['text'] = (poem.get('text') or '').replace('\\n', '\n')
+    poem['line_count'] = len(poem['text'].split('\n'))
+    return poem
+
+
+def summarize_poem(poem: dict) -> dict:
+    """Краткая проекция стиха для списков: без полного текста, с превью первых строк."""
+    text = poem['text']
+    preview = text[:PREVIEW_LENGTH]
+    return {
+        'id': poem.get('id'),
+        'title': poem['title'],
+        'author': poem.get('author'),
+        'line_count': poem['line_count'],
+        'preview': preview if len(text) <= PREVIEW_LENGTH else preview.rstrip() + '…',
+    }
+
+
+def sort_key(poem: dict, field: str) -> tuple:
+    """Ключ сортировки; название в конце делает порядок полным и стабильным."""
+    value = poem[field]
+    if isinstance(value, str):
+        value = value.casefold()
+    return (value, poem['title'])
+
+
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, ensure_ascii=False).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Разбирает курсор из `encode_cursor`. Выбрасывает ValueError, если курсор испорчен."""
+    try:
+        value, title = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+    return (value, title)
+
+
+class PoemPage:
+    """Страница выдачи поиска."""
+
+    def __init__(self, poems: List[dict], total: int, next_cursor: Optional[str]):
+        self.poems = poems
+        self.total = total
+        self.next_cursor = next_cursor
+
+
+class PoemCatalogue:
+    """
+    Версионированный снимок стихов.
+
+    Снимок никогда не изменяется на месте: каждая запись создает новый список и
+    увеличивает `version`, поэтому уже выданные списки можно безопасно отдавать
+    в шаблоны без копирования. Вызывающий код не должен изменять словари стихов.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0, versions: Optional[SharedVersions] = None):
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        # Время последнего изменения содержимого (для Last-Modified)
+        self.modified_at = time.time()
+        self.hits = 0
+        self.misses = 0
+        # Сколько раз снимок заменялся другим содержимым из БД (а не патчился на месте)
+        self.reloads = 0
+        self._poems: Optional[List[dict]] = None
+        self._by_title: Dict[str, dict] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.index = SearchIndex()
+        # Отсортированные представления, построенные для текущей версии
+        self._derived_version = -1
+        self._sorted: Dict[str, Tuple[List[dict], List[tuple]]] = {}
+        self._summaries: Dict[str, dict] = {}
+        self._etag: Optional[str] = None
+        # Названия, которых нет ни в снимке, ни в БД (до следующей версии)
+        self._missing: Set[str] = set()
+        # Общий для воркеров счетчик изменений каталога и его значение на момент загрузки
+        self.versions = versions
+        self._generation = 0
+        # Одновременные промахи ждут одну загрузку
+        self._flight = SingleFlight()
+
+    def is_fresh(self) -> bool:
+        return (
+            self._poems is not None
+            and time.monotonic() - self._loaded_at < self.ttl_seconds
+            and (self.versions is None or self.versions.catalogue_version() == self._generation)
+        )
+
+    async def get(self, loader: Callable[[], Awaitable[List[dict]]]) -> List[dict]:
+        """Возвращает снимок каталога, загружая его через `loader` при промахе."""
+        if self.is_fresh():
+            self.hits += 1
+            return self._poems
+        self.misses += 1
+        return await self._flight.do('load', lambda: self._load(loader))
+
+    async def _load(self, loader: Callable[[], Awaitable[List[dict]]]) -> List[dict]:
+        # Версия читается до загрузки: изменение во время загрузки вызовет еще одну
+        generation = self.versions.catalogue_version() if self.versions is not None else 0
+        rows = await loader()
+        self._swap(await anyio.to_thread.run_sync(self._prepare, rows))
+        self._generation = generation
+        return self._poems
+
+    @property
+    def size(self) -> int:
+        return len(self._poems) if self._poems is not None else 0
+
+    def find(self, title: str) -> Optional[dict]:
+        """Ищет стих по названию в текущем снимке (без обращения к БД)."""
+        return self._by_title.get(title)
+
+    def is_missing(self, title: str) -> bool:
+        """Стиха нет и в БД — это уже проверялось для текущей версии."""
+        self._reset_derived()
+        return title in self._missing
+
+    def mark_missing(self, title: str, version: int) -> None:
+        """
+        Запоминает, что стиха нет в БД. `version` — версия каталога до запроса:
+        если каталог за это время изменился, ответ мог устареть.
+        """
+        self._reset_derived()
+        if version == self.version and len(self._missing) < MISSING_TITLES_MAX:
+            self._missing.add(title)
+
+    def replace(self, rows: List[dict]) -> None:
+        """
+        Заменяет снимок свежими строками из БД. Если содержимое не изменилось,
+        продлевается только TTL, а версия (и ETag) остаются прежними.
+        """
+        self._swap(self._prepare(rows))
+
+    def _prepare(self, rows: List[dict]) -> Optional[Tuple[List[dict], SearchIndex]]:
+        """
+        Тяжелая часть `replace`, безопасная для вызова из другого потока:
+        нормализует строки и готовит обновленную копию индекса, не трогая
+        текущие. None — содержимое не изменилось.
+        """
+        poems = [normalize_poem(dict(row)) for row in rows]
+        if self._poems is not None and {p['title']: p for p in poems} == self._by_title:
+            return None
+        # Копия снимается под блокировкой: upsert/remove меняют индекс под ней же
+        with self._lock:
+            index = self.index.copy()
+        index.sync(poems)
+        return poems, index
+
+    def _swap(self, prepared: Optional[Tuple[List[dict], SearchIndex]]) -> None:
+        with self._lock:
+            if prepared is not None:
+                poems, self.index = prepared
+                self._set(poems)
+                self.reloads += 1
+            self._loaded_at = time.monotonic()
+
+    def upsert(self, poem: dict, original_title: Optional[str] = None) -> dict:
+        """Добавляет или заменяет стих (при переименовании — по `original_title`)."""
+        poem = normalize_poem(dict(poem))
+        key = original_title if original_title is not None else poem['title']
+        with self._lock:
+            if self._poems is not None:
+                poems = [p for p in self._poems if p['title'] not in (key, poem['title'])]
+                poems.append(poem)
+                self._set(poems)
+                if key != poem['title']:
+                    self.index.remove(key)
+                self.index.add(poem)
+        self._publish()
+        return poem
+
+    def upsert_many(self, rows: List[dict]) -> List[dict]:
+        """Пакетный `upsert` без переименований: снимок пересобирается один раз."""
+        poems = [normalize_poem(dict(row)) for row in rows]
+        with self._lock:
+            if self._poems is not None and poems:
+                titles = {p['title'] for p in poems}
+                self._set([p for p in self._poems if p['title'] not in titles] + poems)
+                self.index.add_many(poems)
+        if poems:
+            self._publish()
+        return poems
+
+    def remove(self, title: str) -> None:
+        with self._lock:
+            if self._poems is not None and title in self._by_title:
+                self._set([p for p in self._poems if p['title'] != title])
+                self.index.remove(title)
+        self._publish()
+
+    @property
+    def etag(self) -> str:
+        """
+        Отпечаток содержимого каталога. Зависит только от самих стихов, поэтому
+        совпадает у всех процессов, загрузивших одинаковые данные.
+        """
+        self._reset_derived()
+        if self._etag is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for poem in sorted(self._poems or [], key=lambda p: p['title']):
+                for value in (poem.get('id'), poem['title'], poem.get('author'), poem['text']):
+                    digest.update(str(value).encode())
+                    digest.update(b'\x1f')
+            self._etag = digest.hexdigest()
+        return self._etag
+
+    def summary(self, poem: dict) -> dict:
+        """Сводка стиха из текущего снимка (строится один раз на версию)."""
+        self._reset_derived()
+        summary = self._summaries.get(poem['title'])
+        if summary is None:
+            summary = self._summaries[poem['title']] = summarize_poem(poem)
+        return summary
+
+    def summaries(self) -> List[dict]:
+        return [self.summary(poem) for poem in self._poems or []]
+
+    def sorted_by(self, field: str) -> Tuple[List[dict], List[tuple]]:
+        """Стихи, отсортированные по `field`, и их ключи (для бинарного поиска по курсору)."""
+        self._reset_derived()
+        if field not in self._sorted:
+            poems = sorted(self._poems or [], key=lambda p: sort_key(p, field))
+            self._sorted[field] = (poems, [sort_key(p, field) for p in poems])
+        return self._sorted[field]
+
+    def matching_titles(
+        self,
+        query: str,
+        include: Optional[Collection[str]] = None,
+        exclude: Optional[Collection[str]] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[str], int]:
+        """
+        Названия стихов, подходящих под запрос (пустой запрос — все) и фильтры
+        `include`/`exclude`, и их общее число. С `limit` — только `limit`
+        самых релевантных.
+        """
+        if query.strip():
+            candidates = self.index.scores(query).items()
+        else:
+            candidates = ((poem['title'], 0.0) for poem in self._poems or [])
+        matches = [
+            (title, score) for title, score in candidates
+            if title in self._by_title
+            and (include is None or title in include)
+            and (exclude is None or title not in exclude)
+        ]
+        total = len(matches)
+        if limit is not None and total > limit:
+            matches = heapq.nlargest(limit, matches, key=lambda match: match[1])
+        return [title for title, _ in matches], total
+
+    def page(
+        self,
+        sort: str = 'title',
+        descending: bool = False,
+        query: str = '',
+        include: Optional[Collection[str]] = None,
+        exclude: Optional[Collection[str]] = None,
+        cursor: Optional[str] = None,
+        limit: int = 20,
+    ) -> PoemPage:
+        """
+        Возвращает страницу стихов с keyset-пагинацией.
+
+        `include`/`exclude` — множества названий для фильтра "прочитанные" и
+        "непрочитанные". Курсор хранит ключ сортировки последнего стиха страницы,
+        поэтому добавление и удаление стихов между запросами не сдвигает выдачу.
+
+        С запросом кандидаты берутся из инвертированного индекса, и сортировать
+        нужно только найденное; без запроса используется готовый отсортированный
+        список каталога.
+        """
+        if query.strip():
+            scores = self.index.scores(query)
+            if sort == 'relevance':
+                key = lambda p: (-scores[p['title']], p['title'])
+            else:
+                key = lambda p: sort_key(p, sort)
+            poems = sorted((self._by_title[t] for t in scores if t in self._by_title), key=key)
+            keys = [key(p) for p in poems]
+        else:
+            # Без запроса релевантности нет — порядок по названию
+            effective = 'title' if sort == 'relevance' else sort
+            key = lambda p: sort_key(p, effective)
+            poems, keys = self.sorted_by(effective)
+
+        def wanted(poem: dict) -> bool:
+            if include is not None and poem['title'] not in include:
+                return False
+            if exclude is not None and poem['title'] in exclude:
+                return False
+            return True
+
+        if descending:
+            start = bisect.bisect_left(keys, decode_cursor(cursor)) - 1 if cursor else len(poems) - 1
+            ordered = (poems[i] for i in range(start, -1, -1))
+        else:
+            start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+            ordered = (poems[i] for i in range(start, len(poems)))
+
+        result = []
+        has_more = False
+        for poem in ordered:
+            if wanted(poem):
+                if len(result) == limit:
+                    has_more = True
+                    break
+                result.append(poem)
+
+        if query.strip():
+            total = sum(1 for poem in poems if wanted(poem))
+        else:
+            # Без запроса итог считается по фильтру, без прохода по каталогу
+            filtered = include if include is not None else exclude
+            matched = sum(1 for t in filtered if t in self._by_title) if filtered is not None else 0
+            total = matched if include is not None else len(poems) - matched
+        next_cursor = encode_cursor(key(result[-1])) if has_more else None
+        return PoemPage(result, total, next_cursor)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "size": len(self._poems) if self._poems is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self._flight.shared,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+    def _publish(self) -> None:
+        """Сообщает другим воркерам об изменении каталога."""
+        if self.versions is None:
+            return
+        version = self.versions.bump_catalogue()
+        # Свое изменение уже применено; если между делом были чужие — перечитаем
+        if version == self._generation + 1:
+            self._generation = version
+
+    def _set(self, poems: List[dict]) -> None:
+        self._poems = poems
+        self._by_title = {p['title']: p for p in poems}
+        self.version += 1
+        self.modified_at = time.time()
+
+    def _reset_derived(self) -> None:
+        if self._derived_version != self.version:
+            self._sorted = {}
+            self._summaries = {}
+            self._etag = None
+            self._missing = set()
+            self._derived_version = self.version
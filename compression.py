@@ -0,0 +1,188 @@
+"""
+Сжатие ответов (brotli или gzip — по заголовку Accept-Encoding клиента).
+
+`CompressionMiddleware` сжимает текстовые ответы больше порога, в том числе
+потоковые (сжатие идет по мере отправки частей). Ответы, у которых уже есть
+`Content-Encoding` (например, заранее сжатая главная страница), не трогаются.
+Куски больше `OFFLOAD_MIN_SIZE` (весь каталог в /api/poems и т.п.) сжимаются
+в отдельном потоке, чтобы не останавливать цикл событий.
+
+brotli — необязательная зависимость: без пакета `brotli` используется gzip.
+"""
+import gzip
+import zlib
+from typing import Dict, Optional
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - зависит от окружения
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/x-ndjson', 'image/svg+xml')
+
+# С этого размера (в байтах) сжатие уходит из цикла событий в поток
+OFFLOAD_MIN_SIZE = 64 * 1024
+
+
+def supported_encodings() -> tuple:
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Выбирает лучшее поддерживаемое кодирование из Accept-Encoding (или None)."""
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in supported_encodings():
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """
+    Сжимает тело целиком. Степень умеренная: максимальная (brotli 11) на
+    мегабайтной странице стоит секунды процессора при выигрыше в проценты.
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+async def compress_async(data: bytes, encoding: str) -> bytes:
+    """`compress`, вынесенный в поток для больших тел."""
+    if len(data) < OFFLOAD_MIN_SIZE:
+        return compress(data, encoding)
+    return await anyio.to_thread.run_sync(compress, data, encoding)
+
+
+class _StreamCompressor:
+    def __init__(self, encoding: str):
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=5)
+            self._zlib = None
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._brotli.finish() if self._brotli is not None else self._zlib.flush()
+
+
+def add_vary(headers: MutableHeaders, value: str) -> None:
+    vary = [v.strip() for v in headers.get('vary', '').split(',') if v.strip()]
+    if value.lower() not in {v.lower() for v in vary}:
+        vary.append(value)
+    headers['vary'] = ', '.join(vary)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressingResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressingResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message: Optional[Message] = None
+        self.compressor: Optional[_StreamCompressor] = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_wrapper)
+
+    async def send_wrapper(self, message: Message) -> None:
+        if message['type'] == 'http.response.start':
+            self.start_message = message
+            return
+        if message['type'] != 'http.response.body':
+            await self.send(message)
+            return
+
+        if self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+        if self.compressor is None:
+            headers = MutableHeaders(raw=self.start_message['headers'])
+            content_type = headers.get('content-type', '')
+            if (
+                'content-encoding' in headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+                or (not more_body and len(body) < self.minimum_size)
+            ):
+                self.passthrough = True
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+
+            headers['content-encoding'] = self.encoding
+            add_vary(headers, 'Accept-Encoding')
+            if not more_body:
+                body = await compress_async(body, self.encoding)
+                headers['content-length'] = str(len(body))
+                await self.send(self.start_message)
+                await self.send({'type': 'http.response.body', 'body': body})
+                return
+
+            # Потоковый ответ: длина заранее неизвестна
+            del headers['content-length']
+            self.compressor = _StreamCompressor(self.encoding)
+            await self.send(self.start_message)
+
+        if len(body) < OFFLOAD_MIN_SIZE:
+            chunk = self.compressor.compress(body)
+        else:
+            chunk = await anyio.to_thread.run_sync(self.compressor.compress, body)
+        if not more_body:
+            chunk += self.compressor.finish()
+        await self.send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
+
+
+class PrecompressedPage:
+    """
+    Готовая страница в виде байтов и ее сжатые варианты. Все варианты
+    сжимаются в конструкторе, поэтому создавать страницу нужно вне цикла
+    событий (см. `anyio.to_thread`), а отдавать ее можно без работы.
+    """
+
+    def __init__(self, body: bytes, etag: str):
+        self.body = body
+        self.etag = etag
+        self._variants: Dict[str, bytes] = {encoding: compress(body, encoding) for encoding in supported_encodings()}
+
+    def encoded(self, encoding: Optional[str]) -> bytes:
+        return self._variants[encoding] if encoding is not None else self.body
@@ -0,0 +1,62 @@
+"""
+Необязательный запуск в несколько процессов: gunicorn + воркеры uvicorn по
+числу ядер. По умолчанию (Procfile.txt) приложение работает одним процессом
+uvicorn; этот режим включается явно:
+
+    gunicorn main:app -c gunicorn.conf.py --forwarded-allow-ips='*'
+
+Каждый воркер держит свои кэши; согласованность между ними обеспечивает общий
+файл версий (shared_state.py), который мастер создает до запуска воркеров.
+Переключения прочтения здесь пишутся в БД сразу, без пачек (write_behind.py).
+
+За прокси нужно явно указать, каким адресам доверять X-Forwarded-For
+(FORWARDED_ALLOW_IPS или --forwarded-allow-ips): иначе все клиенты выглядят
+адресом прокси и делят один лимит входа по IP.
+"""
+import multiprocessing
+import os
+import tempfile
+
+from shared_state import SharedVersions
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Воркер готов сразу (см. lifespan в main.py), поэтому таймауты обычные
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# Адреса прокси, которым доверяется X-Forwarded-For: по нему uvicorn
+# определяет IP клиента для ограничения частоты входа (main.py, 2.9).
+# Без явной настройки — только локальный прокси, с предупреждением при старте
+forwarded_allow_ips = os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+
+# Файл версий, созданный этим мастером (удаляется при выходе)
+_owned_state_file = None
+
+
+def on_starting(server):
+    global _owned_state_file
+    # Переменные окружения мастера наследуются воркерами
+    path = os.environ.get("SHARED_STATE_FILE")
+    if not path:
+        path = _owned_state_file = os.path.join(tempfile.gettempdir(), f"poems-shared-{os.getpid()}.bin")
+        os.environ["SHARED_STATE_FILE"] = path
+    SharedVersions.create(path)
+    # Процессов bcrypt и так по одному на воркер — по числу ядер в сумме
+    os.environ.setdefault("PASSWORD_HASH_WORKERS", "1")
+    # Запрос пользователя может попасть в любой воркер: переключения пишутся
+    # в БД сразу, чтобы другие воркеры видели их после инвалидации (write_behind.py)
+    os.environ.setdefault("WRITE_BEHIND_INTERVAL_SECONDS", "0")
+    server.log.info("Shared state file: %s", path)
+    if "FORWARDED_ALLOW_IPS" not in os.environ and set(server.cfg.forwarded_allow_ips) <= {"127.0.0.1", "::1"}:
+        server.log.warning(
+            "forwarded_allow_ips is not configured: X-Forwarded-For is trusted only from 127.0.0.1, "
+            "so behind another proxy every client shares the proxy's login rate limit"
+        )
+
+
+def on_exit(server):
+    if _owned_state_file and os.path.exists(_owned_state_file):
+        os.remove(_owned_state_file)
@@ -0,0 +1,70 @@
+"""
+HTTP-кэширование ответов: ETag, Last-Modified и условные запросы.
+
+Ответ помечается ETag, вычисленным из данных, которые в него попадают.
+Если браузер присылает тот же тег в `If-None-Match`, отвечаем 304 без тела
+и без рендеринга шаблона.
+"""
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterable, Optional
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts: object) -> str:
+    """Слабый ETag: тело может отличаться побайтно (например, из-за сжатия)."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b'\x1f')
+    return f'W/"{digest.hexdigest()}"'
+
+
+def fingerprint_directory(directory: str) -> str:
+    """Отпечаток содержимого файлов каталога — меняет ETag после деплоя новых шаблонов."""
+    digest = hashlib.blake2b(digest_size=8)
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            digest.update(name.encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _strip_weak(tag: str) -> str:
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Слабое сравнение тегов из `If-None-Match` (RFC 9110, 13.1.2)."""
+    if header.strip() == '*':
+        return True
+    tags: Iterable[str] = (tag.strip() for tag in header.split(','))
+    return _strip_weak(etag) in {_strip_weak(tag) for tag in tags}
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cache_headers(etag: str, cache_control: str, last_modified: Optional[float] = None) -> dict:
+    headers = {'ETag': etag, 'Cache-Control': cache_control, 'Vary': 'Cookie'}
+    if last_modified is not None:
+        headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def not_modified(etag: str, cache_control: str, last_modified: Optional[float] = None) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag, cache_control, last_modified))
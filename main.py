@@ -1,24 +1,77 @@
 import os
-from fastapi import FastAPI, Request, Depends, Form, HTTPException, status
-from fastapi.responses import HTMLResponse, RedirectResponse
+import tempfile
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response, Depends, Form, HTTPException, Query, status
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from passlib.context import CryptContext
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+import anyio
 import jwt
 from datetime import datetime, timedelta
-from typing import Optional, List
-import json
+from typing import Dict, Literal, Optional, List, Set, Tuple
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
+from async_db import AsyncDB, is_unique_violation
+from auth_tokens import TokenCache
+from bootstrap import Bootstrap
+from bulk_io import csv_header, csv_poem_line, ndjson_line, parse_csv, parse_ndjson, read_lines
+from catalogue import PoemCatalogue, normalize_poem
+from compression import CompressionMiddleware, PrecompressedPage, add_vary, negotiate_encoding
+from http_cache import cache_headers, fingerprint_directory, is_not_modified, make_etag, not_modified
+from metrics import Metrics, MetricsMiddleware
+from passwords import PasswordHasher, PasswordHasherBusy
+from progress import ProgressSummaries
+from rate_limit import RateLimited, RateLimiter
+from read_progress import ReadProgress, parse_legacy_read_list
+from shared_state import SharedVersions
+from single_flight import SingleFlight
+from user_cache import UserCache, copy_user
+from write_behind import WriteBehindQueue
+
 # --- 0. ЗАГРУЗКА .env ---
 load_dotenv()
 
 # --- 1. КОНФИГУРАЦИЯ ПРИЛОЖЕНИЯ ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Запуск и остановка воркера. Сеть здесь не трогается: клиент Supabase
+    создается при первом запросе, а инициализация данных идет в фоне,
+    поэтому воркер готов принимать запросы сразу.
+    """
+    password_hasher.start()
+    bootstrap.start(lambda: initialize_db_data(async_db))
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        await bootstrap.stop()
+        await write_behind.stop(async_db)
+        password_hasher.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
 templates = Jinja2Templates(directory="templates")
 
+# Метрики процесса для /metrics: время запросов, БД, bcrypt и рендеринга
+metrics = Metrics()
+metrics.instrument_templates(templates.env)
+
+# Версии данных, общие для воркеров (gunicorn.conf.py задает SHARED_STATE_FILE).
+# Без файла приложение работает одним процессом и счетчики живут в памяти
+shared_versions = SharedVersions(os.environ.get("SHARED_STATE_FILE") or None)
+
+# Входит в ETag страниц, чтобы после деплоя новых шаблонов браузеры не держали старые
+TEMPLATES_FINGERPRINT = fingerprint_directory("templates")
+
+# Ответы, зависящие от пользователя, кэшируются только в браузере; общие
+# (текст стиха) — где угодно. И те и другие всегда перепроверяются по ETag
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+PUBLIC_CACHE_CONTROL = "public, no-cache"
+
 # --- 2. НАСТРОЙКА КЛИЕНТА SUPABASE ---
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
@@ -27,12 +80,170 @@ SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise RuntimeError("Supabase URL and Key must be set in the .env file")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+def create_supabase_client() -> Client:
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# Максимум одновременных запросов к Supabase из одного воркера
+DB_MAX_CONCURRENCY = int(os.environ.get("DB_MAX_CONCURRENCY", "16"))
+
+# Клиент создается лениво, при первом обращении к БД
+async_db = AsyncDB(create_supabase_client, max_concurrency=DB_MAX_CONCURRENCY, metrics=metrics)
 
 # Зависимость для получения клиента Supabase
-def get_db() -> Client:
-    """Возвращает экземпляр клиента Supabase."""
-    return supabase
+def get_db() -> AsyncDB:
+    """Возвращает асинхронную обертку над клиентом Supabase."""
+    return async_db
+
+# --- 2.1. КЭШ КАТАЛОГА СТИХОВ ---
+# Снимок таблицы `poem` живет в памяти процесса и обновляется по TTL,
+# а админские маршруты патчат его сразу после записи в БД.
+POEM_CACHE_TTL_SECONDS = float(os.environ.get("POEM_CACHE_TTL_SECONDS", "60"))
+
+poem_catalogue = PoemCatalogue(ttl_seconds=POEM_CACHE_TTL_SECONDS, versions=shared_versions)
+
+async def load_poems(db: AsyncDB) -> List[dict]:
+    response = await db.execute(db.table('poem').select("*"))
+    return response.data or []
+
+async def get_poems(db: AsyncDB) -> List[dict]:
+    """Возвращает нормализованный список стихов из кэша (только для чтения)."""
+    return await poem_catalogue.get(lambda: load_poems(db))
+
+async def find_poem(db: AsyncDB, title: str) -> Optional[dict]:
+    """Стих по названию: из снимка каталога, а если его там нет — из БД."""
+    await get_poems(db)
+    poem = poem_catalogue.find(title)
+    # Отсутствие стиха в БД запоминается до изменения каталога: повторные
+    # запросы несуществующих названий не доходят до Supabase
+    if poem is None and not poem_catalogue.is_missing(title):
+        version = poem_catalogue.version
+        response = await db.execute(db.table('poem').select("*").eq('title', title))
+        if response.data:
+            poem = normalize_poem(response.data[0])
+        else:
+            poem_catalogue.mark_missing(title, version)
+    return poem
+
+async def poem_exists(db: AsyncDB, title: str) -> bool:
+    """
+    Проверяет существование стиха по индексу каталога. В БД идем, только если
+    стиха нет в снимке (он мог появиться после последнего обновления кэша).
+    """
+    return await find_poem(db, title) is not None
+
+# --- 2.2. ПУЛ ХЕШИРОВАНИЯ ПАРОЛЕЙ ---
+# bcrypt выполняется в отдельных процессах, чтобы не блокировать цикл событий.
+# По умолчанию — по процессу на ядро и очередь в 4 раза больше.
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "0")) or None
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "0")) or None
+
+password_hasher = PasswordHasher(max_workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING, metrics=metrics)
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return PlainTextResponse(
+        "Сервер перегружен, попробуйте еще раз через несколько секунд.",
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "5"},
+    )
+
+# --- 2.3. КЭШ ПОЛЬЗОВАТЕЛЕЙ ---
+# Записи пользователей для аутентификации. Права, измененные напрямую в БД,
+# применяются не позже чем через USER_CACHE_TTL_SECONDS.
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_MAX_SIZE = int(os.environ.get("USER_CACHE_MAX_SIZE", "1024"))
+
+user_cache = UserCache(ttl_seconds=USER_CACHE_TTL_SECONDS, max_size=USER_CACHE_MAX_SIZE, versions=shared_versions)
+# Одновременные запросы одного пользователя при промахе кэша читают его из БД один раз
+user_reads = SingleFlight()
+
+# --- 2.4. СТАТУС ПРОЧТЕНИЯ ---
+# Отметки хранятся построчно в таблице `poem_read` (migrations/001_poem_read.sql).
+read_progress = ReadProgress(
+    ttl_seconds=USER_CACHE_TTL_SECONDS,
+    max_size=USER_CACHE_MAX_SIZE,
+    versions=shared_versions,
+    catalogue=poem_catalogue,
+)
+# Сводки прогресса (счетчики на главной и /api/me/progress)
+progress_summaries = ProgressSummaries(ttl_seconds=USER_CACHE_TTL_SECONDS, max_size=USER_CACHE_MAX_SIZE, versions=shared_versions)
+
+# Переключения прочтения и закрепления пишутся в БД пачками раз в
+# WRITE_BEHIND_INTERVAL_SECONDS; 0 — сразу, как раньше (ошибка записи — ответ 500).
+# В каком режиме развертывания что действует — см. write_behind.py
+WRITE_BEHIND_INTERVAL_SECONDS = float(os.environ.get("WRITE_BEHIND_INTERVAL_SECONDS", "0.5"))
+
+write_behind = WriteBehindQueue(
+    flush_interval=WRITE_BEHIND_INTERVAL_SECONDS,
+    versions=shared_versions,
+    user_cache=user_cache,
+    read_progress=read_progress,
+    summaries=progress_summaries,
+)
+
+# --- 2.5. СЖАТИЕ ОТВЕТОВ ---
+# brotli/gzip по Accept-Encoding для текстовых ответов больше порога (в байтах)
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+# Главная для анонимов одинакова для всех, поэтому рендерится один раз на версию
+# каталога и отдается готовыми (и заранее сжатыми) байтами. Ссылки в шаблоне
+# относительные, поэтому страница не зависит от заголовка Host. Рендеринг и
+# сжатие идут в потоке, одновременные запросы ждут одну сборку на ETag
+anonymous_page: Optional[PrecompressedPage] = None
+anonymous_builds = SingleFlight()
+
+# --- 2.6. МАССОВЫЙ ИМПОРТ/ЭКСПОРТ СТИХОВ ---
+# Импорт вставляет стихи пачками, экспорт читает таблицу страницами по id
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "500"))
+EXPORT_PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", "1000"))
+# Сколько ошибок разбора возвращать в ответе (считаются все)
+IMPORT_MAX_REPORTED_ERRORS = 100
+
+# --- 2.7. ИНИЦИАЛИЗАЦИЯ ПРИ ЗАПУСКЕ ---
+# Файл блокировки, по которому воркеры одной машины решают, кто выполняет
+# начальную инициализацию (initialize_db_data)
+BOOTSTRAP_LOCK_FILE = os.environ.get("BOOTSTRAP_LOCK_FILE", os.path.join(tempfile.gettempdir(), "poems-bootstrap.lock"))
+
+bootstrap = Bootstrap(lock_path=BOOTSTRAP_LOCK_FILE)
+
+# --- 2.8. МЕТРИКИ ---
+# Добавляется последним, то есть оборачивает все остальные middleware
+# SERVER_TIMING=1 — отдавать разбивку времени запроса в заголовке Server-Timing
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+# Если задан, /metrics требует заголовок "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+app.add_middleware(MetricsMiddleware, metrics=metrics, server_timing=SERVER_TIMING)
+
+# --- 2.9. ОГРАНИЧЕНИЕ ЧАСТОТЫ ВХОДА И РЕГИСТРАЦИИ ---
+# Вход и регистрация стоят запроса к БД и bcrypt, поэтому ограничены.
+# По имени пользователя: AUTH_RATE_BURST неудачных входов подряд, дальше
+# AUTH_RATE_PER_MINUTE в минуту. По IP бюджет намного больше (за одним
+# адресом NAT или прокси бывает много людей): AUTH_IP_RATE_PER_MINUTE и
+# AUTH_IP_BURST, по умолчанию в 10 раз больше. Удачный вход жетонов не тратит,
+# регистрация тратит IP-жетон всегда. AUTH_RATE_PER_MINUTE=0 отключает оба.
+AUTH_RATE_PER_MINUTE = float(os.environ.get("AUTH_RATE_PER_MINUTE", "10"))
+AUTH_RATE_BURST = int(os.environ.get("AUTH_RATE_BURST", "5"))
+AUTH_IP_RATE_PER_MINUTE = float(os.environ.get("AUTH_IP_RATE_PER_MINUTE", AUTH_RATE_PER_MINUTE * 10))
+AUTH_IP_BURST = int(os.environ.get("AUTH_IP_BURST", AUTH_RATE_BURST * 10))
+
+auth_limiter = RateLimiter(rate_per_minute=AUTH_RATE_PER_MINUTE, burst=AUTH_RATE_BURST)
+auth_ip_limiter = RateLimiter(rate_per_minute=AUTH_IP_RATE_PER_MINUTE, burst=AUTH_IP_BURST)
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return PlainTextResponse(
+        "Слишком много попыток, попробуйте еще раз позже.",
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": exc.retry_after_header},
+    )
+
+def client_ip(request: Request) -> str:
+    # За прокси адрес клиента подставляет uvicorn по X-Forwarded-For от
+    # доверенных прокси (--forwarded-allow-ips в Procfile.txt или FORWARDED_ALLOW_IPS)
+    return request.client.host if request.client else "unknown"
 
 # --- 3. МОДЕЛИ ДАННЫХ Pydantic (SQLAlchemy убраны) ---
 # Модели SQLAlchemy заменены на словари, получаемые от Supabase.
@@ -59,39 +270,61 @@ class ToggleModel(BaseModel):
     
 # --- Вспомогательные функции для работы с данными пользователя ---
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def set_password(password):
-    return get_password_hash(password)
-
-def check_password(password, password_hash):
-    return verify_password(password, password_hash)
-
-def get_read_poems_titles(user: dict) -> List[str]:
-    """Возвращает список заголовков прочитанных стихов из данных пользователя."""
-    return user.get('read_poems_json', [])
+async def get_read_poems_titles(db: AsyncDB, user: dict) -> Set[str]:
+    """Возвращает множество заголовков прочитанных стихов пользователя (с еще не записанными отметками)."""
+    return write_behind.overlay_reads(user['username'], await read_progress.titles(db, user['username']))
 
-def is_poem_read(user: dict, title: str) -> bool:
+async def is_poem_read(db: AsyncDB, user: dict, title: str) -> bool:
     """Проверяет, прочитан ли стих."""
-    return title in get_read_poems_titles(user)
+    return title in await get_read_poems_titles(db, user)
 
-def toggle_poem_read_status(user: dict, title: str) -> str:
-    """Переключает статус прочтения стиха. Возвращает 'marked' или 'unmarked'."""
-    current_reads = get_read_poems_titles(user)
-    
-    if title in current_reads:
-        current_reads.remove(title)
-        action = 'unmarked'
+async def toggle_poem_read_status(db: AsyncDB, user: dict, title: str) -> str:
+    """
+    Переключает статус прочтения стиха. Возвращает 'marked' или 'unmarked'.
+    Кэш обновляется сразу, а запись в БД уходит через очередь write_behind.
+    """
+    is_read = title not in await get_read_poems_titles(db, user)
+    if is_read:
+        read_progress.apply(user['username'], add=[title])
     else:
-        current_reads.append(title)
-        action = 'marked'
-        
-    user['read_poems_json'] = current_reads
-    return action
+        read_progress.apply(user['username'], remove=[title])
+    poem = poem_catalogue.find(title)
+    if poem is not None:
+        progress_summaries.apply_read(user['username'], title, is_read, poem['line_count'])
+    try:
+        await write_behind.set_read(db, user['username'], title, is_read)
+    except Exception:
+        # Запись сразу (без очереди) не удалась — возвращаем кэши как было
+        if is_read:
+            read_progress.apply(user['username'], remove=[title])
+        else:
+            read_progress.apply(user['username'], add=[title])
+        if poem is not None:
+            progress_summaries.apply_read(user['username'], title, not is_read, poem['line_count'])
+        raise
+    return 'marked' if is_read else 'unmarked'
+
+async def get_progress(db: AsyncDB, user: dict) -> dict:
+    """Сводка прогресса пользователя: счетчики прочитанного и закрепленный стих."""
+    await get_poems(db)
+    progress = progress_summaries.get(user['username'], poem_catalogue)
+    if progress is None:
+        version = progress_summaries.version(user['username'])
+        read_titles = await get_read_poems_titles(db, user)
+        progress = progress_summaries.build(user['username'], read_titles, poem_catalogue, version)
+    return dict(progress, pinned_title=user.get('pinned_poem_title'))
+
+async def migrate_read_poems_json(db: AsyncDB, user: dict) -> None:
+    """
+    Переносит отметки из старой колонки `read_poems_json` в `poem_read`
+    и очищает колонку. Выполняется один раз для каждого пользователя.
+    """
+    await get_poems(db)
+    titles = [t for t in parse_legacy_read_list(user.get('read_poems_json')) if poem_catalogue.find(t)]
+    await read_progress.mark(db, user['username'], titles)
+    await db.execute(db.table('user').update({'read_poems_json': []}).eq('username', user['username']))
+    user['read_poems_json'] = []
+    user_cache.update(user['username'], {'read_poems_json': []})
 
 def toggle_pinned_poem(user: dict, title: str) -> str:
     """Переключает статус изучаемого стиха (закреплен/откреплен)."""
@@ -106,8 +339,9 @@ def toggle_pinned_poem(user: dict, title: str) -> str:
 SECRET_KEY = "sUper_sEcrEt_kEy_fOr_pRojeCt_2024_fAstApi"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 # 1 day
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get("TOKEN_CACHE_MAX_SIZE", "4096"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+token_cache = TokenCache(SECRET_KEY, ALGORITHM, max_size=TOKEN_CACHE_MAX_SIZE)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -116,86 +350,236 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_user(db: Client, username: str) -> Optional[dict]:
-    """Получает пользователя из Supabase по имени."""
-    try:
-        response = db.table('user').select("*").eq('username', username).execute()
-        if response.data:
-            return response.data[0]
-        return None
-    except Exception as e:
-        print(f"Error getting user: {e}")
-        return None
+def set_access_cookie(response: Response, user: dict) -> None:
+    # В токене только имя: права и настройки читаются из кэша пользователей,
+    # поэтому их изменения вступают в силу без перевыпуска токена
+    access_token = create_access_token(data={"sub": user['username']})
+    response.set_cookie(
+        key="access_token",
+        value=f"Bearer {access_token}",
+        httponly=True,
+        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        samesite="Lax"
+    )
 
-def get_current_user(request: Request, db: Client = Depends(get_db)) -> dict:
+def get_token_claims(request: Request) -> Optional[dict]:
+    """Claims из cookie без обращения к БД; None — нет токена или он невалиден."""
     token = request.cookies.get("access_token")
     if not token:
+        return None
+    scheme, _, token = token.partition(" ")
+    if scheme != "Bearer" or not token:
+        return None
+    try:
+        return token_cache.verify(token)
+    except jwt.PyJWTError:
+        return None
+
+async def fetch_user(db: AsyncDB, username: str) -> Tuple[int, Optional[dict]]:
+    """
+    Читает пользователя из Supabase; одновременные чтения одного имени
+    схлопываются в один запрос. Возвращает (версию из `user_cache.version`,
+    прочитанную до запроса, запись или None). Запись общая для всех
+    ожидающих — не изменять.
+    """
+    async def load() -> Tuple[int, Optional[dict]]:
+        version = user_cache.version(username)
+        try:
+            response = await db.execute(db.table('user').select("*").eq('username', username))
+            return version, response.data[0] if response.data else None
+        except Exception as e:
+            print(f"Error getting user: {e}")
+            return version, None
+
+    return await user_reads.do(username, load)
+
+async def get_user(db: AsyncDB, username: str) -> Optional[dict]:
+    """Получает пользователя из Supabase по имени."""
+    _, user = await fetch_user(db, username)
+    return copy_user(user) if user is not None else None
+
+async def get_user_cached(db: AsyncDB, username: str) -> Optional[dict]:
+    """Как `get_user`, но сначала смотрит в кэш пользователей."""
+    user = user_cache.get(username)
+    if user is None:
+        version, user = await fetch_user(db, username)
+        if user is not None:
+            user_cache.put(user, version)
+            user = copy_user(user)
+    # Закрепление могло еще не дойти до БД
+    return write_behind.overlay_user(user) if user is not None else None
+
+def require_token_claims(request: Request) -> dict:
+    claims = get_token_claims(request)
+    if claims is None:
+        # Нет токена или он невалиден — перенаправляем на логин
         raise HTTPException(
             status_code=status.HTTP_307_TEMPORARY_REDIRECT,
             detail="Not authenticated",
             headers={"Location": "/login"},
         )
-    try:
-        token = token.split(" ")[1]
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token payload")
-        
-        user = get_user(db, username)
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        return user
-        
-    except (jwt.PyJWTError, IndexError):
-        # Если токен невалиден, перенаправляем на логин
-        response = RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
-        response.delete_cookie("access_token")
-        raise HTTPException(
-            status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-            headers={"Location": "/login"},
-            detail="Could not validate credentials"
-        ) from None
+    if claims.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+    return claims
+
+async def load_user(db: AsyncDB, claims: dict) -> dict:
+    user = await get_user_cached(db, claims["sub"])
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    # Пустой список приходит и как [], и как строка "[]" из текстовой колонки
+    if parse_legacy_read_list(user.get('read_poems_json')):
+        try:
+            await migrate_read_poems_json(db, user)
+        except Exception as e:
+            print(f"Error migrating read poems: {e}")
+
+    return user
+
+async def get_current_user(request: Request, db: AsyncDB = Depends(get_db)) -> dict:
+    return await load_user(db, require_token_claims(request))
 
 
-def get_current_user_optional(request: Request, db: Client = Depends(get_db)) -> Optional[dict]:
+async def get_current_user_optional(request: Request, db: AsyncDB = Depends(get_db)) -> Optional[dict]:
+    # Анонимный запрос отсекается по cookie, без исключений и обращений к кэшу
+    claims = get_token_claims(request)
+    if claims is None or claims.get("sub") is None:
+        return None
     try:
-        return get_current_user(request, db)
+        return await load_user(db, claims)
     except HTTPException:
         return None
 
 # --- 5. МАРШРУТЫ (ЭНДПОИНТЫ) ---
 @app.get("/", response_class=HTMLResponse)
-async def read_root(request: Request, db: Client = Depends(get_db), current_user: Optional[dict] = Depends(get_current_user_optional)):
-    poems_response = db.table('poem').select("*").execute()
-    poems = poems_response.data or []
+async def read_root(request: Request, db: AsyncDB = Depends(get_db), current_user: Optional[dict] = Depends(get_current_user_optional)):
+    await get_poems(db)
+    # На главную уходят только сводки; полный текст грузится при открытии стиха
+    poems = poem_catalogue.summaries()
+
+    if not current_user:
+        return await render_anonymous_root(request, poems)
+
+    read_poems = sorted(await get_read_poems_titles(db, current_user))
+    # Сводка зависит только от каталога и прочитанного — они уже в ETag
+    progress = await get_progress(db, current_user)
+    etag = make_etag(
+        TEMPLATES_FINGERPRINT, poem_catalogue.etag, current_user['username'], current_user.get('is_admin'),
+        current_user.get('show_all_tab'), current_user.get('pinned_poem_title'), *read_poems,
+    )
 
-    for poem in poems:
-        poem['text'] = poem.get('text', '').replace('\\n', '\n')
-        poem['line_count'] = len(poem.get('text', '').split('\n'))
-
-    read_poems = []
-    if current_user:
-        read_poems_json = current_user.get('read_poems_json')
-        if isinstance(read_poems_json, str):
-            try:
-                read_poems = json.loads(read_poems_json)
-            except json.JSONDecodeError:
-                read_poems = []
-        elif isinstance(read_poems_json, list):
-            read_poems = read_poems_json
+    if is_not_modified(request, etag):
+        return not_modified(etag, PRIVATE_CACHE_CONTROL)
 
     context = {
         "request": request,
         "poems": poems,
         "read_poems": read_poems,
+        "progress": progress,
         "pinned_title": current_user.get('pinned_poem_title') if current_user else None,
         "is_admin": current_user.get('is_admin', False) if current_user else False,
         "show_all_tab": current_user.get('show_all_tab', False) if current_user else False,
         "current_user": current_user,
     }
-    return templates.TemplateResponse("index.html", context)
+    return templates.TemplateResponse("index.html", context, headers=cache_headers(etag, PRIVATE_CACHE_CONTROL))
+
+
+async def build_anonymous_page(request: Request, poems: List[dict], etag: str) -> PrecompressedPage:
+    global anonymous_page
+    context = {
+        "request": request,
+        "poems": poems,
+        "read_poems": [],
+        "progress": None,
+        "pinned_title": None,
+        "is_admin": False,
+        "show_all_tab": False,
+        "current_user": None,
+    }
+
+    def build() -> PrecompressedPage:
+        return PrecompressedPage(templates.get_template("index.html").render(context).encode(), etag)
+
+    page = await anyio.to_thread.run_sync(build)
+    anonymous_page = page
+    return page
+
+async def render_anonymous_root(request: Request, poems: List[dict]) -> Response:
+    """Главная для неавторизованных: готовые байты из кэша вместо рендеринга шаблона."""
+    etag = make_etag(TEMPLATES_FINGERPRINT, poem_catalogue.etag)
+    last_modified = poem_catalogue.modified_at
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, PRIVATE_CACHE_CONTROL, last_modified)
+
+    page = anonymous_page
+    if page is None or page.etag != etag:
+        page = await anonymous_builds.do(etag, lambda: build_anonymous_page(request, poems, etag))
+
+    encoding = negotiate_encoding(request.headers.get('accept-encoding', ''))
+    response = Response(page.encoded(encoding), media_type="text/html", headers=cache_headers(etag, PRIVATE_CACHE_CONTROL, last_modified))
+    add_vary(response.headers, 'Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# Сколько названий (самых релевантных) отдает поиск с titles_only
+SEARCH_TITLES_LIMIT = int(os.environ.get("SEARCH_TITLES_LIMIT", "1000"))
+
+@app.get("/api/poems/search")
+async def search_poems_api(
+    q: str = "",
+    filter: Literal["all", "read", "unread"] = "all",
+    sort: Literal["title", "author", "line_count", "relevance"] = "title",
+    order: Literal["asc", "desc"] = "asc",
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    titles_only: bool = False,
+    db: AsyncDB = Depends(get_db),
+    current_user: Optional[dict] = Depends(get_current_user_optional),
+):
+    """
+    Поиск по каталогу с фильтром по статусу прочтения, сортировкой и
+    курсорной пагинацией. Следующая страница — запрос с `cursor=next_cursor`.
+    `sort=relevance` упорядочивает найденное по релевантности запросу `q`.
+
+    `titles_only=true` — одним ответом только названия найденных стихов (не
+    больше SEARCH_TITLES_LIMIT самых релевантных, `total` — сколько найдено
+    всего): главная уже держит сводки каталога и фильтрует их сама.
+    """
+    if filter != "all" and not current_user:
+        raise HTTPException(status_code=401, detail="Фильтр по прочтению доступен только после входа.")
+
+    await get_poems(db)
+    read_titles = await get_read_poems_titles(db, current_user) if current_user else set()
+
+    include = read_titles if filter == "read" else None
+    exclude = read_titles if filter == "unread" else None
+
+    if titles_only:
+        titles, total = poem_catalogue.matching_titles(q, include=include, exclude=exclude, limit=SEARCH_TITLES_LIMIT)
+        return {"success": True, "titles": titles, "total": total}
+
+    try:
+        page = poem_catalogue.page(
+            sort=sort,
+            descending=order == "desc",
+            query=q,
+            include=include,
+            exclude=exclude,
+            cursor=cursor,
+            limit=limit,
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор.") from None
+
+    return {
+        "success": True,
+        "poems": [dict(poem_catalogue.summary(poem), is_read=poem['title'] in read_titles) for poem in page.poems],
+        "total": page.total,
+        "next_cursor": page.next_cursor,
+        "pinned_title": current_user.get('pinned_poem_title') if current_user else None,
+    }
 
 
 @app.get("/register", response_class=HTMLResponse)
@@ -207,29 +591,31 @@ async def register_get(request: Request, current_user: Optional[dict] = Depends(
 @app.post("/register", response_class=HTMLResponse)
 async def register_post(
     request: Request,
-    db: Client = Depends(get_db),
+    db: AsyncDB = Depends(get_db),
     username: str = Form(...),
     password: str = Form(...)
 ):
+    auth_ip_limiter.check(f"register-ip:{client_ip(request)}")
+
     if len(password) < 4:
         return templates.TemplateResponse("register.html", {
             "request": request,
             "error": "Пароль должен быть не менее 4 символов."
         })
 
-    if get_user(db, username):
+    if await get_user(db, username):
         return templates.TemplateResponse("register.html", {
             "request": request,
             "error": "Пользователь с таким именем уже существует!"
         })
 
-    hashed_password = get_password_hash(password)
+    hashed_password = await password_hasher.hash(password)
     
     try:
-        db.table('user').insert({
+        await db.execute(db.table('user').insert({
             "username": username,
             "password_hash": hashed_password
-        }).execute()
+        }))
     except Exception as e:
         return templates.TemplateResponse("register.html", {
             "request": request, "error": f"Ошибка регистрации: {e}"
@@ -253,27 +639,47 @@ async def login_get(request: Request, current_user: Optional[dict] = Depends(get
 @app.post("/login")
 async def login_post(
     request: Request,
-    db: Client = Depends(get_db),
+    db: AsyncDB = Depends(get_db),
     username: str = Form(...),
     password: str = Form(...)
 ):
-    user = get_user(db, username)
-    if not user or not check_password(password, user['password_hash']):
+    # По имени — против перебора пароля одного пользователя с разных адресов
+    ip_key, user_key = f"login-ip:{client_ip(request)}", f"login-user:{username.lower()}"
+    auth_ip_limiter.check(ip_key)
+    try:
+        auth_limiter.check(user_key)
+    except RateLimited:
+        auth_ip_limiter.refund(ip_key)
+        raise
+
+    user = await get_user(db, username)
+    if not user:
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "Неправильный логин или пароль."
         })
 
-    access_token = create_access_token(data={"sub": user['username']})
-    
+    is_valid, new_hash = await password_hasher.verify_and_update(password, user['password_hash'])
+    if not is_valid:
+        return templates.TemplateResponse("login.html", {
+            "request": request,
+            "error": "Неправильный логин или пароль."
+        })
+
+    # Лимит расходуют только неудачные попытки
+    auth_ip_limiter.refund(ip_key)
+    auth_limiter.refund(user_key)
+
+    if new_hash:
+        # Хеш устарел по настройкам CryptContext — прозрачно перехешируем
+        try:
+            await db.execute(db.table('user').update({'password_hash': new_hash}).eq('username', user['username']))
+            user_cache.update(user['username'], {'password_hash': new_hash})
+        except Exception as e:
+            print(f"Error rehashing password: {e}")
+
     response = RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
-    response.set_cookie(
-        key="access_token",
-        value=f"Bearer {access_token}",
-        httponly=True,
-        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-        samesite="Lax"
-    )
+    set_access_cookie(response, user)
     return response
 
 @app.get("/logout")
@@ -290,7 +696,7 @@ async def profile_get(request: Request, current_user: dict = Depends(get_current
 @app.post("/profile", response_class=HTMLResponse)
 async def profile_post(
     request: Request,
-    db: Client = Depends(get_db),
+    db: AsyncDB = Depends(get_db),
     current_user: dict = Depends(get_current_user),
     new_password: Optional[str] = Form(None),
     user_data: Optional[str] = Form(None),
@@ -304,7 +710,7 @@ async def profile_post(
                 "request": request, "current_user": current_user, "user_data": current_user.get('user_data'),
                 "show_all_tab": current_user.get('show_all_tab'), "error": "Новый пароль должен быть не менее 4 символов."
             })
-        update_data['password_hash'] = set_password(new_password)
+        update_data['password_hash'] = await password_hasher.hash(new_password)
 
     if user_data is not None:
         update_data['user_data'] = user_data
@@ -313,53 +719,36 @@ async def profile_post(
 
     if update_data:
         try:
-            response = db.table('user').update(update_data).eq('username', current_user['username']).execute()
+            await db.execute(db.table('user').update(update_data).eq('username', current_user['username']))
             # Обновляем данные пользователя для отображения
             current_user.update(update_data)
+            user_cache.update(current_user['username'], update_data)
 
         except Exception as e:
             return templates.TemplateResponse("profile.html", {
                 "request": request, "current_user": current_user, "error": f"Ошибка обновления: {e}"
             })
 
-    return templates.TemplateResponse("profile.html", {
+    response = templates.TemplateResponse("profile.html", {
         "request": request, "current_user": current_user, "user_data": current_user.get('user_data'),
         "show_all_tab": current_user.get('show_all_tab'), "success": "Настройки профиля обновлены!"
     })
+    return response
 
 
 @app.post("/toggle_read")
 async def toggle_read(
     toggle_data: ToggleModel,
-    db: Client = Depends(get_db),
+    db: AsyncDB = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    poem_resp = db.table('poem').select('title').eq('title', toggle_data.title).execute()
-    if not poem_resp.data:
+    if not await poem_exists(db, toggle_data.title):
         raise HTTPException(status_code=404, detail="Стих не найден")
 
     try:
-        # Get current read list
-        read_json = current_user.get('read_poems_json')
-        if isinstance(read_json, str):
-            read_list = json.loads(read_json)
-        elif isinstance(read_json, list):
-            read_list = read_json
-        else:
-            read_list = []
-
-        # Toggle status
-        if toggle_data.title in read_list:
-            read_list.remove(toggle_data.title)
-            action = "unmarked"
-        else:
-            read_list.append(toggle_data.title)
-            action = "marked"
-
-        # Save back to Supabase
-        db.table('user').update({"read_poems_json": read_list}).eq("username", current_user['username']).execute()
-
-        return {"success": True, "action": action}
+        action = await toggle_poem_read_status(db, current_user, toggle_data.title)
+        # Сводка уже обновлена переключением — отдаем ее, чтобы странице не нужен был второй запрос
+        return {"success": True, "action": action, "progress": await get_progress(db, current_user)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при обновлении БД: {str(e)}")
 
@@ -367,28 +756,60 @@ async def toggle_read(
 @app.post("/toggle_pin")
 async def toggle_pin(
     toggle_data: ToggleModel,
-    db: Client = Depends(get_db),
+    db: AsyncDB = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    poem_resp = db.table('poem').select('title').eq('title', toggle_data.title).execute()
-    if not poem_resp.data:
+    if not await poem_exists(db, toggle_data.title):
         raise HTTPException(status_code=404, detail="Стих не найден")
 
     try:
+        previous_title = current_user.get('pinned_poem_title')
         action = toggle_pinned_poem(current_user, toggle_data.title)
-        
-        db.table('user').update({
-            'pinned_poem_title': current_user['pinned_poem_title']
-        }).eq('username', current_user['username']).execute()
-        
+        user_cache.update(current_user['username'], {'pinned_poem_title': current_user['pinned_poem_title']}, publish=False)
+        try:
+            await write_behind.set_pin(db, current_user['username'], current_user['pinned_poem_title'])
+        except Exception:
+            user_cache.update(current_user['username'], {'pinned_poem_title': previous_title}, publish=False)
+            raise
+
         return {"success": True, "action": action, "pinned_title": current_user['pinned_poem_title']}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при обновлении БД: {str(e)}")
 
 
+@app.get("/api/me/progress")
+async def my_progress_api(db: AsyncDB = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    """Сводка прогресса без списка прочитанного и каталога: обычно без обращения к БД."""
+    return {"success": True, "progress": await get_progress(db, current_user)}
+
+
+@app.get("/healthz")
+async def healthz():
+    """Проверка живости: процесс отвечает."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Готовность принимать трафик: lifespan воркера отработал. Инициализация данных не ждется."""
+    ready = getattr(app.state, "ready", False)
+    return JSONResponse(
+        {"status": "ready" if ready else "starting", "bootstrap": bootstrap.stats()},
+        status_code=200 if ready else 503,
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint(request: Request):
+    """Метрики в текстовом формате Prometheus."""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Требуется токен метрик.")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # --- АДМИН-МАРШРУТЫ ---
 
-def get_admin_user(current_user: dict = Depends(get_current_user)):
+async def get_admin_user(current_user: dict = Depends(get_current_user)):
+    # Права берутся из кэша пользователей: их снятие вступает в силу не
+    # позже USER_CACHE_TTL_SECONDS, как и остальных полей
     if not current_user.get('is_admin'):
         raise HTTPException(status_code=403, detail="Доступ запрещен. Требуются права администратора.")
     return current_user
@@ -398,120 +819,260 @@ async def admin_panel(request: Request, admin: dict = Depends(get_admin_user)):
     return templates.TemplateResponse("admin_panel.html", {"request": request, "current_user": admin})
 
 @app.get("/api/poems")
-async def get_all_poems_api(db: Client = Depends(get_db), admin: dict = Depends(get_admin_user)):
-    poems_resp = db.table('poem').select("*").execute()
-    poems_data = poems_resp.data or []
-    
-    for p in poems_data:
-        p['text'] = p.get('text', '').replace('\\n', '\n')
-        p['line_count'] = len(p.get('text', '').split('\n'))
-        
-    return {"success": True, "poems": poems_data}
+async def get_all_poems_api(request: Request, response: Response, db: AsyncDB = Depends(get_db), admin: dict = Depends(get_admin_user)):
+    poems = await get_poems(db)
+    etag = make_etag(poem_catalogue.etag)
+    if is_not_modified(request, etag, poem_catalogue.modified_at):
+        return not_modified(etag, PRIVATE_CACHE_CONTROL, poem_catalogue.modified_at)
+    response.headers.update(cache_headers(etag, PRIVATE_CACHE_CONTROL, poem_catalogue.modified_at))
+    return {"success": True, "poems": poems}
+
+
+# Не /api/poems/...: стих с названием "search" совпал бы с маршрутом поиска
+@app.get("/api/poem/{title:path}")
+async def get_poem_api(title: str, request: Request, response: Response, db: AsyncDB = Depends(get_db)):
+    """Полный текст стиха для модального окна на главной."""
+    poem = await find_poem(db, title)
+    if poem is None:
+        raise HTTPException(status_code=404, detail="Стих не найден")
+
+    etag = make_etag(poem.get('id'), poem['title'], poem.get('author'), poem['text'])
+    if is_not_modified(request, etag):
+        return not_modified(etag, PUBLIC_CACHE_CONTROL)
+    response.headers.update(cache_headers(etag, PUBLIC_CACHE_CONTROL))
+    return {"success": True, "poem": poem}
+
+
+@app.get("/api/stats")
+async def stats_api(admin: dict = Depends(get_admin_user)):
+    return {
+        "success": True,
+        "poems": poem_catalogue.stats(),
+        "users": user_cache.stats(),
+        "tokens": token_cache.stats(),
+        "write_behind": write_behind.stats(),
+        "bootstrap": bootstrap.stats(),
+        "passwords": password_hasher.stats(),
+        "user_reads": user_reads.stats(),
+        "progress": progress_summaries.stats(),
+        "auth_rate_limit": {"user": auth_limiter.stats(), "ip": auth_ip_limiter.stats()},
+    }
 
 @app.post("/add_poem")
 async def add_poem_post(
     poem_in: PoemCreate,
-    db: Client = Depends(get_db),
+    db: AsyncDB = Depends(get_db),
     admin: dict = Depends(get_admin_user)
 ):
     if not all([poem_in.title, poem_in.author, poem_in.text]):
         raise HTTPException(status_code=400, detail="Все поля должны быть заполнены.")
 
-    if db.table('poem').select('title').eq('title', poem_in.title).execute().data:
-        raise HTTPException(status_code=409, detail=f'Стих с названием "{poem_in.title}" уже существует.')
+    duplicate_error = HTTPException(status_code=409, detail=f'Стих с названием "{poem_in.title}" уже существует.')
+    await get_poems(db)
+    if poem_catalogue.find(poem_in.title) is not None:
+        raise duplicate_error
 
+    # Дубликаты, которых еще нет в кэше, отсекает ограничение уникальности в БД
     try:
-        new_poem_data = poem_in.dict()
-        response = db.table('poem').insert(new_poem_data).execute()
-        
-        if not response.data:
-             raise HTTPException(status_code=500, detail="Не удалось добавить стих.")
-
-        new_poem = response.data[0]
-        new_poem['text'] = new_poem.get('text', '').replace('\\n', '\n')
-        new_poem['line_count'] = len(new_poem.get('text', '').split('\n'))
-
-        return {"success": True, "message": f'Стих "{new_poem["title"]}" успешно добавлен!', "poem": new_poem}
+        response = await db.execute(db.table('poem').insert(poem_in.dict()))
     except Exception as e:
+        if is_unique_violation(e):
+            raise duplicate_error from None
         raise HTTPException(status_code=500, detail=f"Ошибка БД: {str(e)}")
 
+    if not response.data:
+        raise HTTPException(status_code=500, detail="Не удалось добавить стих.")
+
+    new_poem = poem_catalogue.upsert(response.data[0])
+
+    return {"success": True, "message": f'Стих "{new_poem["title"]}" успешно добавлен!', "poem": new_poem}
+
 @app.post("/edit_poem/{original_title}")
 async def edit_poem_post(
     original_title: str,
     poem_in: PoemCreate,
-    db: Client = Depends(get_db),
+    db: AsyncDB = Depends(get_db),
     admin: dict = Depends(get_admin_user)
 ):
-    poem_to_edit = db.table('poem').select('title').eq('title', original_title).execute()
-    if not poem_to_edit.data:
-        raise HTTPException(status_code=404, detail="Стих для редактирования не найден.")
-        
     update_data = poem_in.dict()
 
     if not all(update_data.values()):
         raise HTTPException(status_code=400, detail="Все поля должны быть заполнены.")
-            
-    try:
-        if update_data['title'] != original_title:
-            # Проверяем, не занято ли новое имя
-            if db.table('poem').select('title').eq('title', update_data['title']).execute().data:
-                raise HTTPException(status_code=409, detail=f'Стих с новым названием "{update_data["title"]}" уже существует.')
-        
-        response = db.table('poem').update(update_data).eq('title', original_title).execute()
-        
-        if not response.data:
-             raise HTTPException(status_code=500, detail="Не удалось обновить стих.")
-        
-        updated_poem = response.data[0]
-        updated_poem['text'] = updated_poem.get('text', '').replace('\\n', '\n')
-        updated_poem['line_count'] = len(updated_poem.get('text', '').split('\n'))
-        
-        return {"success": True, "message": f'Стих "{updated_poem["title"]}" успешно обновлен!', "poem": updated_poem}
 
+    # Один запрос: update возвращает измененную строку (пусто — стиха нет),
+    # а занятое новое название отсекает ограничение уникальности
+    try:
+        response = await db.execute(db.table('poem').update(update_data).eq('title', original_title))
     except Exception as e:
+        if is_unique_violation(e):
+            raise HTTPException(status_code=409, detail=f'Стих с новым названием "{update_data["title"]}" уже существует.') from None
         raise HTTPException(status_code=500, detail=f"Ошибка БД: {str(e)}")
 
+    if not response.data:
+        raise HTTPException(status_code=404, detail="Стих для редактирования не найден.")
+
+    old_poem = poem_catalogue.find(original_title)
+    updated_poem = poem_catalogue.upsert(response.data[0], original_title=original_title)
+    if updated_poem['title'] != original_title:
+        read_progress.rename_title(original_title, updated_poem['title'])
+        write_behind.rename_title(original_title, updated_poem['title'])
+    if old_poem is not None:
+        progress_summaries.poem_changed(original_title, updated_poem['title'], updated_poem['line_count'] - old_poem['line_count'])
+
+    return {"success": True, "message": f'Стих "{updated_poem["title"]}" успешно обновлен!', "poem": updated_poem}
+
 @app.post("/delete_poem/{title}")
-async def delete_poem(title: str, db: Client = Depends(get_db), admin: dict = Depends(get_admin_user)):
-    poem_to_delete = db.table('poem').select('title').eq('title', title).execute()
-    if not poem_to_delete.data:
-        raise HTTPException(status_code=404, detail="Стих не найден.")
-        
+async def delete_poem(title: str, db: AsyncDB = Depends(get_db), admin: dict = Depends(get_admin_user)):
     try:
-        db.table('poem').delete().eq('title', title).execute()
-        return {"success": True, "message": f"Стих '{title}' успешно удален."}
+        # delete возвращает удаленные строки: пустой ответ означает, что стиха не было
+        response = await db.execute(db.table('poem').delete().eq('title', title))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при удалении: {str(e)}")
 
+    if not response.data:
+        raise HTTPException(status_code=404, detail="Стих не найден.")
+
+    old_poem = poem_catalogue.find(title)
+    poem_catalogue.remove(title)
+    read_progress.forget_title(title)
+    write_behind.forget_title(title)
+    if old_poem is not None:
+        progress_summaries.forget_title(title, old_poem['line_count'])
+    return {"success": True, "message": f"Стих '{title}' успешно удален."}
+
+
+async def insert_poem_batch(db: AsyncDB, batch: List[dict]) -> int:
+    """Вставляет пачку стихов; существующие названия пропускаются. Возвращает число вставленных."""
+    query = db.table('poem').upsert(batch, on_conflict='title', ignore_duplicates=True)
+    try:
+        response = await db.execute(query)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка БД при импорте: {str(e)}")
+    poem_catalogue.upsert_many(response.data or [])
+    return len(response.data or [])
+
+@app.post("/import_poems")
+async def import_poems(request: Request, db: AsyncDB = Depends(get_db), admin: dict = Depends(get_admin_user)):
+    """
+    Импорт стихов из NDJSON или CSV (по Content-Type). Тело читается потоком,
+    стихи вставляются пачками по IMPORT_BATCH_SIZE. Некорректные строки
+    пропускаются и попадают в отчет, дубликаты названий не перезаписываются.
+    """
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if content_type in ('text/csv', 'application/csv'):
+        records = parse_csv(read_lines(request.stream()))
+    elif content_type in ('application/x-ndjson', 'application/jsonl', 'application/json'):
+        records = parse_ndjson(read_lines(request.stream()))
+    else:
+        raise HTTPException(status_code=415, detail="Поддерживаются только NDJSON (application/x-ndjson) и CSV (text/csv).")
+
+    await get_poems(db)
+    inserted = skipped = error_count = 0
+    errors: List[dict] = []
+    seen: Set[str] = set()
+    batch: List[dict] = []
+
+    def report(line: int, message: str) -> None:
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+            errors.append({"line": line, "error": message})
+
+    async for line, record, error in records:
+        if error is not None:
+            report(line, error)
+            continue
+        try:
+            poem_in = PoemCreate(**record)
+        except ValidationError:
+            report(line, "Нужны строковые поля title, author и text.")
+            continue
+        poem = poem_in.dict()
+        if not all(value.strip() for value in poem.values()):
+            report(line, "Все поля должны быть заполнены.")
+            continue
+        if poem['title'] in seen or poem_catalogue.find(poem['title']) is not None:
+            skipped += 1
+            continue
+        seen.add(poem['title'])
+        batch.append(poem)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            added = await insert_poem_batch(db, batch)
+            inserted += added
+            skipped += len(batch) - added
+            batch = []
+
+    if batch:
+        added = await insert_poem_batch(db, batch)
+        inserted += added
+        skipped += len(batch) - added
+
+    return {
+        "success": True,
+        "message": f"Импортировано стихов: {inserted}, пропущено дубликатов: {skipped}, ошибок: {error_count}.",
+        "inserted": inserted,
+        "skipped_duplicates": skipped,
+        "error_count": error_count,
+        "errors": errors,
+    }
+
+@app.get("/export_poems")
+async def export_poems(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    db: AsyncDB = Depends(get_db),
+    admin: dict = Depends(get_admin_user)
+):
+    """Выгрузка всех стихов потоком: таблица читается страницами по id, а не целиком."""
+    encode = csv_poem_line if format == "csv" else ndjson_line
+
+    async def chunks():
+        if format == "csv":
+            yield csv_header()
+        last_id = None
+        while True:
+            query = db.table('poem').select('id, title, author, text').order('id').limit(EXPORT_PAGE_SIZE)
+            if last_id is not None:
+                query = query.gt('id', last_id)
+            rows = (await db.execute(query)).data or []
+            if rows:
+                yield ''.join(encode(normalize_poem(row)) for row in rows)
+            if len(rows) < EXPORT_PAGE_SIZE:
+                break
+            last_id = rows[-1]['id']
+
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson; charset=utf-8"
+    headers = {"Content-Disposition": f'attachment; filename="poems.{format}"', "Cache-Control": "no-store"}
+    return StreamingResponse(chunks(), media_type=media_type, headers=headers)
+
 
 # --- 6. ИНИЦИАЛИЗАЦИЯ ДАННЫХ (для Supabase) ---
-def initialize_db_data():
+async def initialize_db_data(db: AsyncDB):
     """
     Проверяет наличие админа и создает его, если он отсутствует.
     Не трогает таблицу со стихами.
     """
-    db = get_db()
-    
+    # Запускается в фоне из lifespan (см. bootstrap.py). Ошибки пробрасываются,
+    # чтобы Bootstrap повторил попытку
+    response = await db.execute(db.table('user').select('username').eq('username', 'admin'))
+    if response.data:
+        return
+    ADMIN_PASSWORD = 'zynqochka'
+    admin_user_data = {
+        'username': 'admin',
+        'password_hash': await password_hasher.hash(ADMIN_PASSWORD),
+        'is_admin': True
+    }
     try:
-        if not get_user(db, 'admin'):
-            ADMIN_PASSWORD = 'zynqochka'
-            admin_user_data = {
-                'username': 'admin', 
-                'password_hash': get_password_hash(ADMIN_PASSWORD),
-                'is_admin': True
-            }
-            db.table('user').insert(admin_user_data).execute()
-            print("Администратор 'admin' создан в Supabase.")
+        await db.execute(db.table('user').insert(admin_user_data))
     except Exception as e:
-        print(f"Ошибка при создании админа: {e}")
+        # Админа успел создать воркер на другой машине
+        if is_unique_violation(e):
+            return
+        raise
+    print("Администратор 'admin' создан в Supabase.")
 
 
 if __name__ == "__main__":
-    print("Инициализация данных в Supabase...")
-    initialize_db_data()
     print("Запуск FastAPI приложения...")
     import uvicorn
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
-else:
-    # Этот блок выполняется, когда gunicorn/uvicorn запускают приложение
-    initialize_db_data()
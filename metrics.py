@@ -0,0 +1,220 @@
+"""
+Метрики времени ответа в формате Prometheus.
+
+`MetricsMiddleware` замеряет каждый HTTP-запрос и раскладывает его время по
+фазам: запросы к Supabase (`db`), bcrypt (`bcrypt`) и рендеринг шаблонов
+(`render`). Фазы отмечаются через `Metrics.timer(...)` в местах, где идет
+работа; накопленные за запрос значения хранятся в `ContextVar`, поэтому их
+не нужно передавать через аргументы.
+
+По желанию те же значения отдаются браузеру в заголовке `Server-Timing`
+(видны во вкладке Network инструментов разработчика).
+"""
+import bisect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import jinja2
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Границы корзин гистограмм времени, в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Границы корзин числа запросов к БД за один HTTP-запрос
+DB_CALLS_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+PHASES = ('db', 'bcrypt', 'render')
+
+# Метка маршрута для запросов, не попавших ни в один эндпоинт (статика, 404)
+UNMATCHED_ROUTE = 'other'
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name: str, labels: str) -> List[str]:
+        sep = ',' if labels else ''
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            result.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        result.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f'{{{labels}}}' if labels else ''
+        result.append(f'{name}_sum{suffix} {self.sum:.6f}')
+        result.append(f'{name}_count{suffix} {self.count}')
+        return result
+
+
+class RequestTimings:
+    """Время и число вызовов по фазам в рамках одного HTTP-запроса."""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def server_timing(self, total_seconds: float) -> str:
+        parts = [
+            f'{phase};dur={self.seconds[phase] * 1000:.1f};desc="{self.calls[phase]}x"'
+            for phase in PHASES if phase in self.seconds
+        ]
+        parts.append(f'total;dur={total_seconds * 1000:.1f}')
+        return ', '.join(parts)
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Реестр метрик процесса. Обновляется только из цикла событий, поэтому без блокировок."""
+
+    def __init__(self):
+        self.requests: Dict[Tuple[str, str, str], Histogram] = {}
+        self.phases: Dict[str, Histogram] = {phase: Histogram(LATENCY_BUCKETS) for phase in PHASES}
+        self.db_calls_per_request = Histogram(DB_CALLS_BUCKETS)
+        self.db_seconds_per_request = Histogram(LATENCY_BUCKETS)
+        self.started_at = time.time()
+
+    def record(self, phase: str, seconds: float) -> None:
+        """Учитывает одну операцию фазы (в гистограмме процесса и в текущем запросе)."""
+        self.phases[phase].observe(seconds)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(phase, seconds)
+
+    @contextmanager
+    def timer(self, phase: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - started)
+
+    def observe_request(self, method: str, route: str, status_code: int, seconds: float, timings: RequestTimings) -> None:
+        key = (method, route, str(status_code))
+        histogram = self.requests.get(key)
+        if histogram is None:
+            histogram = self.requests[key] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+        self.db_calls_per_request.observe(timings.calls.get('db', 0))
+        self.db_seconds_per_request.observe(timings.seconds.get('db', 0.0))
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus (version 0.0.4)."""
+        lines = [
+            '# HELP http_request_duration_seconds Время обработки HTTP-запроса.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (method, route, status_code), histogram in sorted(self.requests.items()):
+            labels = f'method="{method}",route="{_escape(route)}",status="{status_code}"'
+            lines += histogram.lines('http_request_duration_seconds', labels)
+
+        lines += [
+            '# HELP app_phase_duration_seconds Длительность отдельных операций: запрос к БД, bcrypt, рендеринг шаблона.',
+            '# TYPE app_phase_duration_seconds histogram',
+        ]
+        for phase, histogram in self.phases.items():
+            lines += histogram.lines('app_phase_duration_seconds', f'phase="{phase}"')
+
+        lines += [
+            '# HELP app_db_calls_per_request Число запросов к Supabase за один HTTP-запрос.',
+            '# TYPE app_db_calls_per_request histogram',
+        ]
+        lines += self.db_calls_per_request.lines('app_db_calls_per_request', '')
+        lines += [
+            '# HELP app_db_seconds_per_request Суммарное время запросов к Supabase за один HTTP-запрос.',
+            '# TYPE app_db_seconds_per_request histogram',
+        ]
+        lines += self.db_seconds_per_request.lines('app_db_seconds_per_request', '')
+        lines += [
+            '# HELP process_start_time_seconds Время запуска процесса (unix).',
+            '# TYPE process_start_time_seconds gauge',
+            f'process_start_time_seconds {self.started_at:.3f}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def instrument_templates(self, env: jinja2.Environment) -> None:
+        """Учитывает рендеринг всех шаблонов окружения как фазу `render`."""
+        metrics = self
+
+        class TimedTemplate(env.template_class):
+            def render(self, *args, **kwargs):
+                with metrics.timer('render'):
+                    return super().render(*args, **kwargs)
+
+        env.template_class = TimedTemplate
+        # Уже загруженные шаблоны созданы старым классом
+        if env.cache is not None:
+            env.cache.clear()
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, metrics: Metrics, server_timing: bool = False):
+        self.app = app
+        self.metrics = metrics
+        self.server_timing = server_timing
+        self._route_paths: Dict[object, str] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                if self.server_timing:
+                    headers = MutableHeaders(raw=message['headers'])
+                    headers.append('Server-Timing', timings.server_timing(time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_timings.reset(token)
+            self.metrics.observe_request(
+                scope['method'], self._route_label(scope), status_code, time.perf_counter() - started, timings,
+            )
+
+    def _route_label(self, scope: Scope) -> str:
+        # Метка — шаблон пути маршрута ("/api/poems/{title:path}"), а не сам путь,
+        # иначе число временных рядов росло бы с каждым новым URL
+        route = scope.get('route')
+        if route is not None and hasattr(route, 'path'):
+            return route.path
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        if endpoint not in self._route_paths:
+            for candidate in getattr(scope.get('app'), 'routes', ()):
+                if getattr(candidate, 'endpoint', None) is endpoint:
+                    self._route_paths[endpoint] = candidate.path
+                    break
+        return self._route_paths.get(endpoint, UNMATCHED_ROUTE)
@@ -0,0 +1,21 @@
+-- Нормализованное хранение статуса прочтения: одна строка на пару (пользователь, стих).
+-- Заменяет массив "user".read_poems_json, который переписывался целиком при каждом клике.
+
+create table if not exists poem_read (
+    username   text not null references "user" (username) on update cascade on delete cascade,
+    poem_title text not null references poem (title) on update cascade on delete cascade,
+    read_at    timestamptz not null default now(),
+    primary key (username, poem_title)
+);
+
+-- Перенос уже отмеченных стихов из старой колонки.
+-- Приложение также переносит их лениво при первом входе пользователя,
+-- так что запуск этого блока ускоряет миграцию, но не обязателен.
+insert into poem_read (username, poem_title)
+select u.username, titles.title
+from "user" u
+cross join lateral jsonb_array_elements_text(coalesce(u.read_poems_json::jsonb, '[]'::jsonb)) as titles(title)
+join poem p on p.title = titles.title
+on conflict do nothing;
+
+update "user" set read_poems_json = '[]' where read_poems_json::jsonb <> '[]'::jsonb;
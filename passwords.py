@@ -0,0 +1,102 @@
+"""
+Сервис хеширования паролей.
+
+bcrypt намеренно медленный (сотни миллисекунд CPU на операцию), поэтому
+хеширование и проверка выполняются в отдельном пуле процессов, размер которого
+равен числу ядер. Очередь ограничена: если ожидающих операций слишком много,
+новые сразу отклоняются с `PasswordHasherBusy`, а не копятся бесконечно.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+from metrics import Metrics
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+# --- Функции, выполняемые в процессах пула ---
+# Должны быть на уровне модуля, чтобы их можно было передать в дочерний процесс.
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, password_hash)
+
+def _noop() -> None:
+    return None
+
+
+class PasswordHasherBusy(Exception):
+    """Очередь на хеширование переполнена — запрос нужно повторить позже."""
+
+
+class PasswordHasher:
+    """Пул процессов для bcrypt с ограниченной очередью и метриками задержек."""
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None, metrics: Optional[Metrics] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 4
+        self.metrics = metrics
+        self.pending = 0
+        self.stats_by_op: Dict[str, dict] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        """Создает пул и заранее поднимает все процессы."""
+        if self._executor is not None:
+            return
+        # fork дешевле spawn и не импортирует заново модуль приложения в воркерах
+        context = multiprocessing.get_context("fork") if os.name == "posix" else None
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        for _ in range(self.max_workers):
+            self._executor.submit(_noop)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def hash(self, password: str) -> str:
+        return await self._submit("hash", _hash, password)
+
+    async def verify_and_update(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        """
+        Проверяет пароль. Вторым элементом возвращает новый хеш, если текущий
+        устарел по настройкам `CryptContext` (иначе None).
+        """
+        return await self._submit("verify", _verify_and_update, password, password_hash)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "operations": self.stats_by_op,
+        }
+
+    async def _submit(self, op: str, func: Callable, *args):
+        op_stats = self.stats_by_op.setdefault(op, {"count": 0, "rejected": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        if self.pending >= self.max_pending:
+            op_stats["rejected"] += 1
+            raise PasswordHasherBusy(op)
+
+        self.start()
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+            elapsed = time.perf_counter() - started
+            op_stats["count"] += 1
+            op_stats["total_seconds"] += elapsed
+            op_stats["max_seconds"] = max(op_stats["max_seconds"], elapsed)
+            if self.metrics is not None:
+                self.metrics.record("bcrypt", elapsed)
@@ -0,0 +1,147 @@
+"""
+Сводка прогресса пользователя: сколько стихов прочитано и сколько строк в них.
+
+Раньше счетчики на главной считал браузер, проходя по всему каталогу и списку
+прочитанного. Теперь сводка считается на сервере один раз — по множеству
+прочитанных стихов и снимку каталога — и дальше поддерживается
+инкрементально: переключение прочтения, правка и удаление стиха меняют ее за
+O(1) (правка и удаление — за проход по закэшированным сводкам).
+
+Сводка пересчитывается заново, если каталог был перечитан из БД с другим
+содержимым (`PoemCatalogue.reloads`), истек TTL или изменилась версия
+пользователя в `SharedVersions` (запись из другого воркера).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from catalogue import PoemCatalogue
+from shared_state import SharedVersions
+
+
+class _Progress:
+    __slots__ = ('titles', 'lines_read', 'loaded_at', 'version', 'reloads')
+
+    def __init__(self, titles: set, lines_read: int, version: int, reloads: int):
+        # Прочитанные стихи, которые есть в каталоге
+        self.titles = titles
+        self.lines_read = lines_read
+        self.loaded_at = time.monotonic()
+        self.version = version
+        self.reloads = reloads
+
+
+class ProgressSummaries:
+    """LRU-кэш сводок прогресса по пользователям."""
+
+    def __init__(self, ttl_seconds: float = 30.0, max_size: int = 1024, versions: Optional[SharedVersions] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.versions = versions
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, _Progress]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str, catalogue: PoemCatalogue) -> Optional[dict]:
+        """Сводка из кэша или None, если ее нужно построить (`build`)."""
+        with self._lock:
+            entry = self._entries.get(username)
+            if (
+                entry is None
+                or time.monotonic() - entry.loaded_at >= self.ttl_seconds
+                or entry.version != self.version(username)
+                or entry.reloads != catalogue.reloads
+            ):
+                self._entries.pop(username, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return self._summary(entry, catalogue)
+
+    def version(self, username: str) -> int:
+        return self.versions.user_version(username) if self.versions is not None else 0
+
+    def build(self, username: str, read_titles: Iterable[str], catalogue: PoemCatalogue, version: int) -> dict:
+        """
+        Считает сводку по множеству прочитанных стихов и кладет ее в кэш.
+        `version` — значение `version()`, прочитанное до загрузки множества.
+        """
+        titles = set()
+        lines_read = 0
+        for title in read_titles:
+            poem = catalogue.find(title)
+            if poem is not None:
+                titles.add(title)
+                lines_read += poem['line_count']
+        entry = _Progress(titles, lines_read, version, catalogue.reloads)
+        with self._lock:
+            self._entries[username] = entry
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return self._summary(entry, catalogue)
+
+    # --- инкрементальные изменения ---
+
+    def advance(self, username: str, version: int) -> None:
+        """Как `UserCache.advance`: своя запись не делает сводку устаревшей."""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return
+            if version == entry.version + 1:
+                entry.version = version
+            else:
+                del self._entries[username]
+
+    def apply_read(self, username: str, title: str, is_read: bool, line_count: int) -> None:
+        """Учитывает переключение прочтения стиха с `line_count` строками."""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return
+            if is_read and title not in entry.titles:
+                entry.titles.add(title)
+                entry.lines_read += line_count
+            elif not is_read and title in entry.titles:
+                entry.titles.discard(title)
+                entry.lines_read -= line_count
+
+    def poem_changed(self, old_title: str, new_title: str, line_delta: int) -> None:
+        """Учитывает правку стиха: переименование и изменение числа строк."""
+        with self._lock:
+            for entry in self._entries.values():
+                if old_title in entry.titles:
+                    entry.titles.discard(old_title)
+                    entry.titles.add(new_title)
+                    entry.lines_read += line_delta
+
+    def forget_title(self, title: str, line_count: int) -> None:
+        """Учитывает удаление стиха (отметки удаляются каскадом)."""
+        with self._lock:
+            for entry in self._entries.values():
+                if title in entry.titles:
+                    entry.titles.discard(title)
+                    entry.lines_read -= line_count
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    @staticmethod
+    def _summary(entry: _Progress, catalogue: PoemCatalogue) -> dict:
+        # Новые стихи сводку не трогают: непрочитанные — это все остальные
+        total = catalogue.size
+        return {
+            "total": total,
+            "read": len(entry.titles),
+            "unread": total - len(entry.titles),
+            "lines_read": entry.lines_read,
+        }
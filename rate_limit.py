@@ -0,0 +1,95 @@
+"""
+Ограничение частоты запросов к входу и регистрации (token bucket).
+
+Каждый ключ (IP-адрес, имя пользователя) получает "ведро" на `burst` жетонов,
+которое пополняется со скоростью `rate_per_minute` жетонов в минуту. Запрос
+тратит по жетону из каждого своего ведра; если хотя бы одно пусто, запрос
+отклоняется с `RateLimited`, и ни один жетон не списывается. Удачная попытка
+возвращает жетоны (`refund`), так что лимит расходуют только неудачные —
+а жетон все равно берется заранее, и одновременные попытки не проходят
+сверх лимита.
+
+Ведра хранятся в памяти процесса (LRU не больше `max_keys`), поэтому при
+нескольких воркерах фактический предел умножается на их число. Вытесняются
+давно не использованные ведра — к этому моменту они обычно уже полны.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+
+class RateLimited(Exception):
+    """Лимит исчерпан; `retry_after` — через сколько секунд появится жетон."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class RateLimiter:
+    def __init__(self, rate_per_minute: float, burst: int, max_keys: int = 10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.limited = 0
+        self.refunded = 0
+        # ключ -> (жетоны, время последнего пополнения)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 and self.burst > 0
+
+    def check(self, *keys: str) -> None:
+        """Списывает по жетону с каждого ключа или бросает `RateLimited`."""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens = {key: self._refill(key, now) for key in keys}
+            empty = [value for value in tokens.values() if value < 1]
+            if empty:
+                self.limited += 1
+                raise RateLimited((1 - min(empty)) / self.rate)
+            for key, value in tokens.items():
+                self._buckets[key] = (value - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            self.allowed += 1
+
+    def refund(self, *keys: str) -> None:
+        """Возвращает жетоны, списанные `check` (попытка оказалась удачной)."""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                if key in self._buckets:
+                    self._buckets[key] = (min(float(self.burst), self._refill(key, now) + 1), now)
+            self.refunded += 1
+
+    def _refill(self, key: str, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return float(self.burst)
+        tokens, updated_at = bucket
+        return min(float(self.burst), tokens + (now - updated_at) * self.rate)
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_minute": self.rate * 60,
+            "burst": self.burst,
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "refunded": self.refunded,
+        }
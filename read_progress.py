@@ -0,0 +1,138 @@
+"""
+Статус прочтения стихов.
+
+Каждая отметка — отдельная строка таблицы `poem_read` (см.
+migrations/001_poem_read.sql), поэтому отметить или снять отметку можно одной
+атомарной вставкой или удалением, не переписывая весь список пользователя.
+Параллельные переключения из разных вкладок больше не затирают друг друга.
+
+Множества прочитанных стихов кэшируются в памяти процесса. Переключения
+применяются к кэшу сразу (`apply`), а в БД записываются отложенно
+(см. write_behind.py). Как и в `UserCache`, множество хранится с версией
+пользователя из `SharedVersions`, чтобы видеть записи других воркеров.
+
+Переименование и удаление стиха меняют отметки каскадом в БД. Свой воркер
+патчит кэш сразу (`rename_title`, `forget_title`), а в остальных множество
+устаревает вместе со снимком каталога: оно помнит `PoemCatalogue.reloads`
+на момент загрузки и перечитывается, когда каталог перезагрузился.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Set
+
+from async_db import AsyncDB
+from catalogue import PoemCatalogue
+from shared_state import SharedVersions
+
+READ_TABLE = 'poem_read'
+
+
+def parse_legacy_read_list(value) -> List[str]:
+    """Разбирает старую колонку `read_poems_json` (список или JSON-строка)."""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return []
+    return [title for title in value if isinstance(title, str)] if isinstance(value, list) else []
+
+
+class ReadProgress:
+    """Операции над таблицей `poem_read` с LRU-кэшем множеств по пользователям."""
+
+    def __init__(
+        self,
+        ttl_seconds: float = 30.0,
+        max_size: int = 1024,
+        versions: Optional[SharedVersions] = None,
+        catalogue: Optional[PoemCatalogue] = None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.versions = versions
+        self.catalogue = catalogue
+        self._sets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def titles(self, db: AsyncDB, username: str) -> Set[str]:
+        """Возвращает множество названий прочитанных стихов (копию)."""
+        cached = self._get(username)
+        if cached is None:
+            version = self._version(username)
+            reloads = self._reloads()
+            response = await db.execute(db.table(READ_TABLE).select('poem_title').eq('username', username))
+            cached = {row['poem_title'] for row in response.data or []}
+            self._put(username, cached, version, reloads)
+        return set(cached)
+
+    async def mark(self, db: AsyncDB, username: str, titles: Iterable[str]) -> None:
+        """Отмечает стихи прочитанными; повторная отметка ничего не меняет."""
+        rows = [{'username': username, 'poem_title': title} for title in titles]
+        if not rows:
+            return
+        await db.execute(
+            db.table(READ_TABLE).upsert(rows, on_conflict='username,poem_title', ignore_duplicates=True)
+        )
+        self.apply(username, add=[row['poem_title'] for row in rows])
+
+    def rename_title(self, old_title: str, new_title: str) -> None:
+        """Повторяет в кэше каскадное переименование (`on update cascade`)."""
+        with self._lock:
+            for _, titles, _, _ in self._sets.values():
+                if old_title in titles:
+                    titles.discard(old_title)
+                    titles.add(new_title)
+
+    def forget_title(self, title: str) -> None:
+        """Повторяет в кэше каскадное удаление (`on delete cascade`)."""
+        with self._lock:
+            for _, titles, _, _ in self._sets.values():
+                titles.discard(title)
+
+    def _get(self, username: str) -> Optional[Set[str]]:
+        with self._lock:
+            entry = self._sets.get(username)
+            if (
+                entry is None
+                or time.monotonic() - entry[0] >= self.ttl_seconds
+                or entry[2] != self._version(username)
+                or entry[3] != self._reloads()
+            ):
+                self._sets.pop(username, None)
+                return None
+            self._sets.move_to_end(username)
+            return entry[1]
+
+    def _version(self, username: str) -> int:
+        return self.versions.user_version(username) if self.versions is not None else 0
+
+    def _reloads(self) -> int:
+        return self.catalogue.reloads if self.catalogue is not None else 0
+
+    def _put(self, username: str, titles: Set[str], version: int, reloads: int) -> None:
+        with self._lock:
+            self._sets[username] = (time.monotonic(), set(titles), version, reloads)
+            self._sets.move_to_end(username)
+            while len(self._sets) > self.max_size:
+                self._sets.popitem(last=False)
+
+    def advance(self, username: str, version: int) -> None:
+        """Как `UserCache.advance`: своя запись не делает множество устаревшим."""
+        with self._lock:
+            entry = self._sets.get(username)
+            if entry is None:
+                return
+            if version == entry[2] + 1:
+                self._sets[username] = (entry[0], entry[1], version, entry[3])
+            else:
+                del self._sets[username]
+
+    def apply(self, username: str, add: Iterable[str] = (), remove: Iterable[str] = ()) -> None:
+        """Обновляет закэшированное множество пользователя (если оно есть)."""
+        with self._lock:
+            entry = self._sets.get(username)
+            if entry is not None:
+                entry[1].update(add)
+                entry[1].difference_update(remove)
@@ -0,0 +1,257 @@
+"""
+Инвертированный индекс для полнотекстового поиска по стихам.
+
+Текст разбивается на слова (`\\w+` понимает кириллицу), приводится к нижнему
+регистру (`ё` → `е`) и урезается простым стеммером по окончаниям, чтобы
+"любовь", "любви" и "любовью" попадали в один терм. Слова запроса ищутся как
+префиксы термов, поэтому поиск работает уже во время набора слова.
+
+Префиксом считается только последнее слово запроса (его еще набирают),
+остальные сравниваются с термами целиком. Целые слова вычисляются первыми:
+если они уже сузили выдачу, префикс проверяется только по термам найденных
+стихов, а не разворачивается по всему словарю. Префиксы короче
+`MIN_PREFIX_LENGTH` ищутся как целые слова — "л" или "ла" подходят почти к
+каждому стиху, и такой поиск на каждое нажатие клавиши обходил бы весь индекс.
+Результаты последних запросов кэшируются до изменения индекса.
+
+Вес вхождения зависит от поля: название важнее автора, автор важнее текста.
+Все слова запроса должны найтись в стихе; результаты ранжируются по сумме весов.
+"""
+import bisect
+import re
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TOKEN_RE = re.compile(r'\w+')
+
+FIELD_WEIGHTS = (('title', 3.0), ('author', 2.0), ('text', 1.0))
+
+# Совпадение по префиксу (а не по целому терму) весит меньше
+PREFIX_MATCH_WEIGHT = 0.5
+
+# Более короткое последнее слово запроса ищется как целое слово
+MIN_PREFIX_LENGTH = 3
+
+# До стольких стихов-кандидатов префикс проверяется по их термам, а не по словарю
+CANDIDATE_SCAN_LIMIT = 2000
+
+# Сколько последних запросов помнит индекс
+RESULT_CACHE_SIZE = 256
+
+# Окончания, отрезаемые стеммером; длинные проверяются первыми
+ENDINGS = frozenset((
+    'иями', 'ями', 'ами', 'ией', 'ием', 'иях', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ешь', 'ишь', 'ает', 'яет', 'ует', 'ают', 'яют', 'уют', 'ить', 'ать', 'ять', 'еть',
+    'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом', 'ах', 'ях',
+    'ия', 'ья', 'ию', 'ью', 'ов', 'ев', 'ам', 'ям', 'ть', 'ла', 'ло', 'ли', 'ет', 'ут',
+    'ют', 'ит', 'ат', 'ят', 'ing', 'ed', 'es',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й', 's',
+))
+ENDING_LENGTHS = sorted({len(ending) for ending in ENDINGS}, reverse=True)
+
+MIN_STEM_LENGTH = 3
+
+
+def stem(word: str) -> str:
+    for length in ENDING_LENGTHS:
+        if len(word) - length >= MIN_STEM_LENGTH and word[-length:] in ENDINGS:
+            return word[:-length]
+    return word
+
+
+class _StemCache(dict):
+    """Память уже разобранных слов: словарь стихов ограничен, а слов в них миллионы."""
+
+    max_size = 500_000
+
+    def __missing__(self, word: str) -> str:
+        if len(self) >= self.max_size:
+            self.clear()
+        result = self[word] = stem(word)
+        return result
+
+
+_stems = _StemCache()
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова текста в нижнем регистре, без стемминга."""
+    return TOKEN_RE.findall(text.casefold().replace('ё', 'е'))
+
+
+class SearchIndex:
+    """
+    Индекс `терм -> {id стиха: вес}` с инкрементальным обновлением.
+
+    Стихи идентифицируются названием. Повторный `add` того же стиха с тем же
+    автором и текстом ничего не делает, поэтому `sync` после перезагрузки
+    каталога переиндексирует только действительно изменившиеся стихи.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, float]] = {}
+        # Отсортированный список термов для поиска по префиксу. Термы без
+        # вхождений не удаляются из него сразу, а пропускаются при поиске
+        self._terms: List[str] = []
+        self._doc_ids: Dict[str, int] = {}
+        self._doc_titles: Dict[int, str] = {}
+        self._doc_terms: Dict[int, Tuple[int, Tuple[str, ...]]] = {}
+        self._next_id = 0
+        # Нормализованный запрос -> результат `scores`; сбрасывается при изменениях
+        self._results: "OrderedDict[Tuple[str, ...], Dict[str, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    def copy(self) -> 'SearchIndex':
+        """Независимая копия: ее можно обновлять, пока исходный индекс обслуживает поиск."""
+        index = SearchIndex()
+        index._postings = {term: dict(postings) for term, postings in self._postings.items()}
+        index._terms = list(self._terms)
+        index._doc_ids = dict(self._doc_ids)
+        index._doc_titles = dict(self._doc_titles)
+        index._doc_terms = dict(self._doc_terms)
+        index._next_id = self._next_id
+        return index
+
+    def add(self, poem: dict) -> None:
+        for term in self._add(poem):
+            i = bisect.bisect_left(self._terms, term)
+            if i == len(self._terms) or self._terms[i] != term:
+                self._terms.insert(i, term)
+
+    def add_many(self, poems: Iterable[dict]) -> None:
+        """Пакетное добавление: список термов пересобирается один раз."""
+        new_terms = False
+        for poem in poems:
+            new_terms = bool(self._add(poem)) or new_terms
+        if new_terms:
+            self._terms = sorted(self._postings)
+
+    def _add(self, poem: dict) -> List[str]:
+        """Индексирует стих и возвращает термы, у которых появились первые вхождения."""
+        title = poem['title']
+        fingerprint = hash((poem.get('author') or '', poem.get('text') or ''))
+        doc_id = self._doc_ids.get(title)
+        if doc_id is not None:
+            if self._doc_terms[doc_id][0] == fingerprint:
+                return []
+            self.remove(title)
+        self._results.clear()
+
+        weights: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS:
+            for term, count in Counter(map(_stems.__getitem__, tokenize(poem.get(field) or ''))).items():
+                weights[term] = weights.get(term, 0.0) + weight * count
+
+        doc_id = self._next_id
+        self._next_id += 1
+        self._doc_ids[title] = doc_id
+        self._doc_titles[doc_id] = title
+        self._doc_terms[doc_id] = (fingerprint, tuple(weights))
+        new_terms = []
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                new_terms.append(term)
+            postings[doc_id] = weight
+        return new_terms
+
+    def remove(self, title: str) -> None:
+        doc_id = self._doc_ids.pop(title, None)
+        if doc_id is None:
+            return
+        self._results.clear()
+        del self._doc_titles[doc_id]
+        for term in self._doc_terms.pop(doc_id)[1]:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+
+    def sync(self, poems: Iterable[dict]) -> None:
+        """Приводит индекс к переданному набору стихов."""
+        titles = set()
+        new_terms = False
+        for poem in poems:
+            titles.add(poem['title'])
+            new_terms = bool(self._add(poem)) or new_terms
+        for title in [t for t in self._doc_ids if t not in titles]:
+            self.remove(title)
+        # Список термов пересобирается один раз, а не вставкой по одному
+        if new_terms or len(self._terms) > 2 * len(self._postings):
+            self._terms = sorted(self._postings)
+
+    def scores(self, query: str) -> Dict[str, float]:
+        """
+        Названия стихов, содержащих все слова запроса, с их релевантностью.
+        Результат может быть общим с другими вызовами — не изменять.
+        """
+        words = tuple(tokenize(query))
+        if not words:
+            return {}
+        cached = self._results.get(words)
+        if cached is not None:
+            self._results.move_to_end(words)
+            return cached
+
+        *complete, last = words
+        result: Optional[Dict[int, float]] = None
+        # Целые слова: пересечение, начиная с самого короткого списка вхождений
+        for postings in sorted((self._postings.get(_stems[word], {}) for word in complete), key=len):
+            if result is None:
+                result = dict(postings)
+            else:
+                result = {doc_id: score + postings[doc_id] for doc_id, score in result.items() if doc_id in postings}
+            if not result:
+                break
+        if result is None or result:
+            matches = self._match_last(_stems[last], result)
+            if result is None:
+                result = matches
+            else:
+                result = {doc_id: score + matches[doc_id] for doc_id, score in result.items() if doc_id in matches}
+
+        titles = {self._doc_titles[doc_id]: score for doc_id, score in result.items()}
+        self._results[words] = titles
+        if len(self._results) > RESULT_CACHE_SIZE:
+            self._results.popitem(last=False)
+        return titles
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Результаты поиска, отсортированные по убыванию релевантности."""
+        ranked = sorted(self.scores(query).items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit is not None else ranked
+
+    def _match_last(self, prefix: str, candidates: Optional[Dict[int, float]]) -> Dict[int, float]:
+        """Вхождения последнего слова запроса (как префикса), при возможности — только среди `candidates`."""
+        if len(prefix) < MIN_PREFIX_LENGTH:
+            return self._postings.get(prefix, {})
+        matches: Dict[int, float] = {}
+        if candidates is not None and len(candidates) <= CANDIDATE_SCAN_LIMIT:
+            for doc_id in candidates:
+                for term in self._doc_terms[doc_id][1]:
+                    if term.startswith(prefix):
+                        score = self._postings[term][doc_id] * (1.0 if term == prefix else PREFIX_MATCH_WEIGHT)
+                        if score > matches.get(doc_id, 0.0):
+                            matches[doc_id] = score
+            return matches
+        for term in self._expand(prefix):
+            factor = 1.0 if term == prefix else PREFIX_MATCH_WEIGHT
+            for doc_id, weight in self._postings[term].items():
+                score = weight * factor
+                if score > matches.get(doc_id, 0.0):
+                    matches[doc_id] = score
+        return matches
+
+    def _expand(self, prefix: str) -> List[str]:
+        """Все термы, начинающиеся с `prefix`: неполная выдача спрятала бы найденные стихи."""
+        found = []
+        terms = self._terms
+        i = bisect.bisect_left(terms, prefix)
+        while i < len(terms) and terms[i].startswith(prefix):
+            if terms[i] in self._postings:
+                found.append(terms[i])
+            i += 1
+        return found
@@ -0,0 +1,87 @@
+"""
+Счетчики версий, общие для всех воркеров одной машины.
+
+Каждый воркер gunicorn держит свои кэши (каталог стихов, пользователи,
+отметки прочтения). Чтобы после записи в одном воркере остальные не отдавали
+устаревшие данные, запись увеличивает счетчик версии в общем файле,
+отображенном в память (mmap). Кэши запоминают версию, при которой данные были
+загружены, и при расхождении перечитывают их из БД.
+
+Счетчиков два вида: один на каталог стихов и `USER_SLOTS` на пользователей
+(пользователь попадает в слот по хешу имени). Коллизия слотов приводит лишь
+к лишнему перечитыванию, а не к устаревшим данным.
+
+Без файла (`path=None`, один процесс) счетчики живут в памяти процесса.
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+USER_SLOTS = 4096
+_COUNTER = struct.Struct('<Q')
+_CATALOGUE_SLOT = 0
+
+
+class SharedVersions:
+    def __init__(self, path: Optional[str] = None, user_slots: int = USER_SLOTS):
+        self.path = path
+        self.user_slots = user_slots
+        self.size = _COUNTER.size * (1 + user_slots)
+        self._lock = threading.Lock()
+        if path is None:
+            self._file = None
+            self._buffer = bytearray(self.size)
+        else:
+            self._file = open(path, 'r+b') if os.path.exists(path) else open(path, 'w+b')
+            if os.path.getsize(path) < self.size:
+                self._file.truncate(self.size)
+            self._buffer = mmap.mmap(self._file.fileno(), self.size)
+
+    @classmethod
+    def create(cls, path: str, user_slots: int = USER_SLOTS) -> None:
+        """Создает (обнуляет) общий файл. Вызывается мастер-процессом до запуска воркеров."""
+        with open(path, 'wb') as f:
+            f.truncate(_COUNTER.size * (1 + user_slots))
+
+    @property
+    def shared(self) -> bool:
+        return self._file is not None
+
+    def catalogue_version(self) -> int:
+        return self._read(_CATALOGUE_SLOT)
+
+    def bump_catalogue(self) -> int:
+        return self._increment(_CATALOGUE_SLOT)
+
+    def user_version(self, username: str) -> int:
+        return self._read(self._user_slot(username))
+
+    def bump_user(self, username: str) -> int:
+        return self._increment(self._user_slot(username))
+
+    def _user_slot(self, username: str) -> int:
+        return 1 + zlib.crc32(username.encode()) % self.user_slots
+
+    def _read(self, slot: int) -> int:
+        return _COUNTER.unpack_from(self._buffer, slot * _COUNTER.size)[0]
+
+    def _increment(self, slot: int) -> int:
+        # Блокировка файла делает чтение-изменение-запись атомарным между процессами
+        with self._lock:
+            if self._file is not None and fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                value = self._read(slot) + 1
+                _COUNTER.pack_into(self._buffer, slot * _COUNTER.size, value)
+                return value
+            finally:
+                if self._file is not None and fcntl is not None:
+                    fcntl.flock(self._file, fcntl.LOCK_UN)
@@ -0,0 +1,44 @@
+"""
+Схлопывание одинаковых одновременных чтений из БД (single-flight).
+
+Когда кэш пуст или устарел, все запросы, пришедшие за время загрузки, иначе
+отправили бы в Supabase каждый свой одинаковый `select`. `SingleFlight.do`
+запускает загрузку только для первого из них, а остальные ждут ее результат.
+
+Результат один на всех ожидающих: если вызывающий код изменяет его, он
+должен сам сделать копию.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        # Сколько загрузок запущено и сколько вызовов присоединились к уже идущей
+        self.calls = 0
+        self.shared = 0
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.get_running_loop().create_task(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+        # Отмена одного ожидающего (клиент закрыл соединение) не прерывает
+        # загрузку для остальных
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Ошибку получили ожидающие; если все они были отменены, asyncio
+            # иначе предупредил бы о непрочитанном исключении
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "shared": self.shared, "inflight": len(self._inflight)}
@@ -0,0 +1,39 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bulk_io import parse_csv, read_lines
+
+
+async def chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def parse(text: str, **kwargs):
+    async def collect():
+        return [record async for record in parse_csv(read_lines(chunks(text.encode(), 7)), **kwargs)]
+    return asyncio.run(collect())
+
+
+def test_multiline_quoted_field():
+    records = parse('title,author,text\nА,Б,"строка 1\nстрока ""2"""\nВ,Г,д\n')
+    assert records == [
+        (2, {'title': 'А', 'author': 'Б', 'text': 'строка 1\nстрока "2"'}, None),
+        (4, {'title': 'В', 'author': 'Г', 'text': 'д'}, None),
+    ]
+
+
+def test_oversized_record_is_reported_and_skipped():
+    body = 'title,author,text\nА,Б,"незакрыто\n' + 'строка\n' * 100 + 'конец"\nВ,Г,д\n'
+    records = parse(body, max_record_size=200)
+    assert [(line, error is not None) for line, _, error in records] == [(2, True), (104, False)]
+    assert records[1][1]['title'] == 'В'
+
+
+def test_unclosed_quote_at_end_of_file():
+    records = parse('title,author,text\nА,Б,"незакрыто\n' + 'строка\n' * 100, max_record_size=200)
+    assert len(records) == 1
+    assert records[0][2] is not None
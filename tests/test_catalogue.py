@@ -0,0 +1,72 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalogue import PoemCatalogue
+
+
+def make_catalogue(count: int) -> PoemCatalogue:
+    catalogue = PoemCatalogue()
+    catalogue.replace([
+        {'id': i, 'title': f'Стих {i:03}', 'author': f'Автор {i % 7}', 'text': 'строка\\nстрока'}
+        for i in range(count)
+    ])
+    return catalogue
+
+
+def test_relevance_without_query_pages_by_title():
+    catalogue = make_catalogue(50)
+    seen = []
+    cursor = None
+    while True:
+        page = catalogue.page(sort='relevance', cursor=cursor, limit=20)
+        seen.extend(poem['title'] for poem in page.poems)
+        assert page.total == 50
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert seen == sorted(seen)
+    assert len(seen) == 50
+
+
+def test_prefix_search_returns_every_match():
+    catalogue = PoemCatalogue()
+    catalogue.replace([
+        {'id': i, 'title': f'Стих {i}', 'author': 'Автор', 'text': f'слово{i}'}
+        for i in range(200)
+    ])
+    assert len(catalogue.index.scores('сло')) == 200
+    assert catalogue.page(query='слов', limit=20).total == 200
+    # После целого слова префикс проверяется только по найденным стихам
+    assert catalogue.page(query='стих слово1', limit=20).total == 111
+
+
+def test_short_prefix_matches_whole_words_only():
+    catalogue = PoemCatalogue()
+    catalogue.replace([
+        {'id': 1, 'title': 'Я', 'author': 'Автор', 'text': 'я помню чудное мгновенье'},
+        {'id': 2, 'title': 'Ялта', 'author': 'Автор', 'text': 'ялта'},
+    ])
+    assert set(catalogue.index.scores('я')) == {'Я'}
+    assert set(catalogue.index.scores('ялт')) == {'Ялта'}
+
+
+def test_matching_titles_is_bounded_but_reports_total():
+    catalogue = make_catalogue(50)
+    titles, total = catalogue.matching_titles('стих', exclude={'Стих 000'}, limit=10)
+    assert len(titles) == 10
+    assert total == 49
+    assert 'Стих 000' not in titles
+
+
+def test_missing_titles_are_forgotten_when_catalogue_changes():
+    catalogue = make_catalogue(3)
+    catalogue.mark_missing('Новый', catalogue.version)
+    assert catalogue.is_missing('Новый')
+    catalogue.upsert({'id': 99, 'title': 'Новый', 'author': 'Автор', 'text': 'строка'})
+    assert not catalogue.is_missing('Новый')
+    # Ответ БД, полученный до изменения каталога, не запоминается
+    stale = catalogue.version - 1
+    catalogue.mark_missing('Другой', stale)
+    assert not catalogue.is_missing('Другой')
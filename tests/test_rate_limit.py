@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limit import RateLimited, RateLimiter
+
+
+def test_refund_returns_tokens_of_successful_attempts():
+    limiter = RateLimiter(rate_per_minute=1, burst=2)
+    for _ in range(10):
+        limiter.check('ip')
+        limiter.refund('ip')
+    limiter.check('ip')
+    limiter.check('ip')
+    with pytest.raises(RateLimited):
+        limiter.check('ip')
+
+
+def test_limited_attempt_spends_nothing():
+    limiter = RateLimiter(rate_per_minute=1, burst=1)
+    limiter.check('ip', 'user')
+    with pytest.raises(RateLimited):
+        limiter.check('other-ip', 'user')
+    # Ведро другого ключа не тронуто отклоненной попыткой
+    limiter.check('other-ip')
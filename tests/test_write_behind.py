@@ -0,0 +1,189 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from async_db import AsyncDB
+from fake_supabase import FakeSupabase
+from read_progress import READ_TABLE, ReadProgress
+from shared_state import SharedVersions
+from user_cache import UserCache
+from write_behind import WriteBehindQueue
+
+
+def make_db(titles=('A', 'B', 'C')):
+    client = FakeSupabase()
+    client.tables['user'].append({'username': 'u', 'password_hash': 'x', 'is_admin': False, 'pinned_poem_title': None})
+    client.tables['poem'].extend({'id': i, 'title': title, 'author': 'X', 'text': 'строка'} for i, title in enumerate(titles))
+    return client, AsyncDB(lambda: client)
+
+
+def read_rows(client):
+    return sorted(row['poem_title'] for row in client.tables[READ_TABLE] if row['username'] == 'u')
+
+
+class FlakyDB(AsyncDB):
+    """Проваливает изменяющие запросы, пока `failures` больше нуля."""
+
+    def __init__(self, client, on_failure=None):
+        super().__init__(lambda: client)
+        self.failures = 0
+        self.on_failure = on_failure
+
+    async def execute(self, query):
+        if query.op != 'select' and self.failures > 0:
+            self.failures -= 1
+            if self.on_failure is not None:
+                await self.on_failure()
+            raise RuntimeError('db down')
+        return await super().execute(query)
+
+
+def test_toggles_are_coalesced_into_one_write_per_kind():
+    client, db = make_db()
+
+    async def scenario():
+        queue = WriteBehindQueue(flush_interval=60)
+        for title in ('A', 'B', 'A', 'C', 'A'):
+            current = title in queue.overlay_reads('u', set())
+            await queue.set_read(db, 'u', title, not current)
+        assert queue.overlay_reads('u', set()) == {'A', 'B', 'C'}
+        await queue.stop(db)
+        return queue
+
+    queue = asyncio.run(scenario())
+    # Одна вставка (удалений нет: итог по каждому стиху — прочитан)
+    assert client.calls == 1
+    assert read_rows(client) == ['A', 'B', 'C']
+    assert queue.stats()['pending_reads'] == 0
+
+
+def test_failed_flush_does_not_override_newer_toggle():
+    client, _ = make_db()
+    queue = WriteBehindQueue(flush_interval=60)
+
+    async def newer_toggle():
+        # Пользователь снял отметку, пока шла неудачная запись
+        await queue.set_read(db, 'u', 'A', False)
+
+    db = FlakyDB(client, on_failure=newer_toggle)
+
+    async def scenario():
+        await queue.set_read(db, 'u', 'A', True)
+        await queue.set_read(db, 'u', 'B', True)
+        db.failures = 1
+        await queue.flush(db)
+        assert queue.overlay_reads('u', set()) == {'B'}
+        await queue.stop(db)
+
+    asyncio.run(scenario())
+    assert queue.stats()['failures'] == 1
+    assert read_rows(client) == ['B']
+
+
+def test_foreign_key_violation_is_dropped():
+    client, db = make_db()
+
+    async def scenario():
+        queue = WriteBehindQueue(flush_interval=60)
+        await queue.set_read(db, 'u', 'Удаленный', True)
+        await queue.flush(db)
+        return queue
+
+    queue = asyncio.run(scenario())
+    stats = queue.stats()
+    assert stats['failures'] == 1
+    assert stats['pending_reads'] == 0
+    assert read_rows(client) == []
+
+
+def test_write_through_failure_raises_and_keeps_version():
+    client, _ = make_db()
+    db = FlakyDB(client)
+    versions = SharedVersions()
+    queue = WriteBehindQueue(flush_interval=0, versions=versions)
+    db.failures = 1
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(queue.set_read(db, 'u', 'A', True))
+    assert versions.user_version('u') == 0
+    assert read_rows(client) == []
+
+
+def test_toggle_is_rolled_back_when_direct_write_fails():
+    os.environ.setdefault('SUPABASE_URL', 'http://localhost')
+    os.environ.setdefault('SUPABASE_KEY', 'key')
+    import main
+
+    client, _ = make_db()
+    db = FlakyDB(client)
+    user = {'username': 'u'}
+
+    async def scenario():
+        await main.get_poems(db)
+        before = await main.get_progress(db, user)
+        db.failures = 1
+        with pytest.raises(RuntimeError):
+            await main.toggle_poem_read_status(db, user, 'A')
+        return before, await main.get_read_poems_titles(db, user), await main.get_progress(db, user)
+
+    interval = main.write_behind.flush_interval
+    main.write_behind.flush_interval = 0
+    try:
+        before, titles, after = asyncio.run(scenario())
+    finally:
+        main.write_behind.flush_interval = interval
+    assert titles == set()
+    assert after == before
+    assert read_rows(client) == []
+
+
+def make_cached_queue(client, db):
+    versions = SharedVersions()
+    user_cache = UserCache(versions=versions)
+    user_cache.put(dict(client.tables['user'][0]))
+    read_progress = ReadProgress(versions=versions)
+    queue = WriteBehindQueue(flush_interval=60, versions=versions, user_cache=user_cache, read_progress=read_progress)
+    return versions, user_cache, read_progress, queue
+
+
+def test_flush_advances_own_caches_without_reload():
+    client, db = make_db()
+    versions, user_cache, read_progress, queue = make_cached_queue(client, db)
+
+    async def scenario():
+        await read_progress.titles(db, 'u')
+        await queue.set_read(db, 'u', 'A', True)
+        await queue.set_pin(db, 'u', 'A')
+        await queue.stop(db)
+        calls = client.calls
+        titles = await read_progress.titles(db, 'u')
+        return calls, titles
+
+    calls, titles = asyncio.run(scenario())
+    assert titles == {'A'}
+    assert user_cache.get('u')['pinned_poem_title'] == 'A'
+    # Множество и пользователь взяты из кэша
+    assert client.calls == calls
+
+
+def test_flush_drops_caches_when_another_worker_bumped_version():
+    client, db = make_db()
+    versions, user_cache, read_progress, queue = make_cached_queue(client, db)
+
+    async def scenario():
+        await read_progress.titles(db, 'u')
+        await queue.set_read(db, 'u', 'A', True)
+        # Другой воркер изменил пользователя между загрузкой и записью
+        client.tables[READ_TABLE].append({'username': 'u', 'poem_title': 'B'})
+        versions.bump_user('u')
+        await queue.stop(db)
+        return await read_progress.titles(db, 'u')
+
+    assert asyncio.run(scenario()) == {'A', 'B'}
+    assert user_cache.get('u') is None
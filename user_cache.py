@@ -0,0 +1,116 @@
+"""
+Кэш записей пользователей для аутентификации.
+
+`get_current_user` вызывается на каждый запрос авторизованного пользователя.
+Кэш хранит запись по имени пользователя ограниченное время (TTL) и вытесняет
+давно не использованные записи (LRU), поэтому изменения, сделанные в обход
+приложения (например, выдача прав администратора в Supabase), становятся
+видны не позже чем через TTL.
+
+При нескольких воркерах запись хранится вместе с версией пользователя из
+`SharedVersions`: изменение в другом воркере делает ее устаревшей сразу.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from shared_state import SharedVersions
+
+
+def copy_user(user: dict) -> dict:
+    # Маршруты изменяют полученный словарь (и списки внутри него) до записи в БД,
+    # поэтому наружу всегда отдается копия
+    return {key: list(value) if isinstance(value, list) else value for key, value in user.items()}
+
+
+class UserCache:
+    """LRU-кэш пользователей с ограничением по размеру и времени жизни записи."""
+
+    def __init__(self, ttl_seconds: float = 30.0, max_size: int = 1024, versions: Optional[SharedVersions] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.versions = versions
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if (
+                entry is None
+                or time.monotonic() - entry[0] >= self.ttl_seconds
+                or entry[2] != self.version(username)
+            ):
+                if entry is not None:
+                    del self._entries[username]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return copy_user(entry[1])
+
+    def version(self, username: str) -> int:
+        """Текущая общая версия пользователя (0 без SharedVersions)."""
+        return self.versions.user_version(username) if self.versions is not None else 0
+
+    def put(self, user: dict, version: Optional[int] = None) -> None:
+        """
+        Кладет запись в кэш. `version` — значение `version()`, прочитанное до
+        загрузки записи из БД, чтобы не пропустить изменение во время загрузки.
+        """
+        if version is None:
+            version = self.version(user['username'])
+        with self._lock:
+            self._entries[user['username']] = (time.monotonic(), copy_user(user), version)
+            self._entries.move_to_end(user['username'])
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def update(self, username: str, fields: dict, publish: bool = True) -> None:
+        """
+        Применяет успешно записанные в БД поля к закэшированной записи и
+        сообщает об изменении другим воркерам. `publish=False` — поля еще не
+        записаны (их запишет и опубликует очередь write-behind).
+        """
+        version = self.versions.bump_user(username) if publish and self.versions is not None else None
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return
+            if version is not None and version != entry[2] + 1:
+                # Пропущено чужое изменение — запись перечитается из БД
+                del self._entries[username]
+                return
+            entry[1].update(copy_user(fields))
+            if version is not None:
+                self._entries[username] = (entry[0], entry[1], version)
+
+    def advance(self, username: str, version: int) -> None:
+        """
+        Своя запись увеличила версию пользователя до `version` и уже применена
+        к кэшу: запись остается актуальной, если других изменений не было.
+        """
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return
+            if version == entry[2] + 1:
+                self._entries[username] = (entry[0], entry[1], version)
+            else:
+                del self._entries[username]
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl_seconds": self.ttl_seconds,
+        }
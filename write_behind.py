@@ -0,0 +1,242 @@
+"""
+Отложенная (write-behind) запись отметок прочтения и закрепленного стиха.
+
+Клик по переключателю сразу меняет состояние в памяти процесса и отвечает
+клиенту, а в БД изменения уходят пачкой раз в `flush_interval` секунд. Все
+переключения одного пользователя за это окно схлопываются: по каждому стиху
+пишется только итоговое состояние (одна вставка и одно удаление на
+пользователя), по закреплению — одно обновление строки `user`.
+
+Пока изменения не записаны, они накладываются на данные из кэшей и БД
+(`overlay_reads`, `overlay_user`), поэтому пользователь видит свои действия,
+даже если кэш успел вытеснить запись. Неудавшаяся запись возвращается в
+очередь и повторяется в следующем окне. При остановке приложения очередь
+сбрасывается в БД (`stop`).
+
+С `flush_interval <= 0` очередь не используется: изменение пишется в БД
+сразу, и ошибка записи уходит вызывающему коду.
+
+После успешной записи версия пользователя в `SharedVersions` увеличивается,
+и другие воркеры перечитывают его данные из БД. Кэши своего воркера уже
+содержат записанное и переходят на новую версию без перечитывания
+(`advance`), если в промежутке никто другой пользователя не менял.
+
+Какой режим развертывания пишет пачками:
+
+- один процесс uvicorn (Procfile.txt, по умолчанию) — пачками раз в
+  WRITE_BEHIND_INTERVAL_SECONDS (0.5 с);
+- gunicorn с несколькими воркерами (gunicorn.conf.py, включается явно) —
+  сразу: несохраненные изменения живут в памяти одного воркера, а следующий
+  запрос пользователя может попасть в другой, который их не увидит. Поэтому
+  gunicorn.conf.py выставляет WRITE_BEHIND_INTERVAL_SECONDS=0. Задав интервал
+  явно, можно писать пачками и там, но тогда пользователь до
+  `flush_interval` секунд может не видеть своих переключений.
+"""
+import asyncio
+import threading
+from typing import Dict, Optional, Set
+
+from async_db import AsyncDB
+from progress import ProgressSummaries
+from read_progress import READ_TABLE, ReadProgress
+from shared_state import SharedVersions
+from user_cache import UserCache
+
+# Нарушение внешнего ключа: стих удалили, пока отметка ждала записи
+FOREIGN_KEY_VIOLATION = '23503'
+
+
+class WriteBehindQueue:
+    """Очередь несохраненных переключений с периодическим сбросом в БД."""
+
+    def __init__(
+        self,
+        flush_interval: float = 0.5,
+        versions: Optional[SharedVersions] = None,
+        user_cache: Optional[UserCache] = None,
+        read_progress: Optional[ReadProgress] = None,
+        summaries: Optional[ProgressSummaries] = None,
+    ):
+        self.flush_interval = flush_interval
+        self.versions = versions
+        self.user_cache = user_cache
+        self.read_progress = read_progress
+        self.summaries = summaries
+        self.flushes = 0
+        self.failures = 0
+        # username -> {название стиха: прочитан ли}
+        self._reads: Dict[str, Dict[str, bool]] = {}
+        # username -> закрепленный стих (None — откреплен)
+        self._pins: Dict[str, Optional[str]] = {}
+        # То, что сейчас записывается в БД: до конца записи тоже накладывается
+        self._inflight_reads: Dict[str, Dict[str, bool]] = {}
+        self._inflight_pins: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    # --- постановка в очередь ---
+
+    async def set_read(self, db: AsyncDB, username: str, title: str, is_read: bool) -> None:
+        if self.flush_interval <= 0:
+            await self._write_reads(db, username, {title: is_read})
+            self._publish(username)
+            return
+        with self._lock:
+            self._reads.setdefault(username, {})[title] = is_read
+        self._schedule(db)
+
+    async def set_pin(self, db: AsyncDB, username: str, title: Optional[str]) -> None:
+        if self.flush_interval <= 0:
+            await self._write_pin(db, username, title)
+            self._publish(username)
+            return
+        with self._lock:
+            self._pins[username] = title
+        self._schedule(db)
+
+    # --- чтение своих записей ---
+
+    def overlay_reads(self, username: str, titles: Set[str]) -> Set[str]:
+        """Применяет несохраненные отметки пользователя к множеству из кэша/БД."""
+        with self._lock:
+            pending = {**self._inflight_reads.get(username, {}), **self._reads.get(username, {})}
+        for title, is_read in pending.items():
+            if is_read:
+                titles.add(title)
+            else:
+                titles.discard(title)
+        return titles
+
+    def overlay_user(self, user: dict) -> dict:
+        """Применяет несохраненное закрепление к записи пользователя."""
+        with self._lock:
+            for pins in (self._inflight_pins, self._pins):
+                if user['username'] in pins:
+                    user['pinned_poem_title'] = pins[user['username']]
+        return user
+
+    # --- каскады из админских маршрутов ---
+
+    def rename_title(self, old_title: str, new_title: str) -> None:
+        with self._lock:
+            for pending in (*self._reads.values(), *self._inflight_reads.values()):
+                if old_title in pending:
+                    pending[new_title] = pending.pop(old_title)
+
+    def forget_title(self, title: str) -> None:
+        with self._lock:
+            for pending in (*self._reads.values(), *self._inflight_reads.values()):
+                pending.pop(title, None)
+
+    # --- запись в БД ---
+
+    async def flush(self, db: AsyncDB) -> None:
+        """Записывает все накопленные изменения; неудавшиеся возвращаются в очередь."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            with self._lock:
+                reads, self._reads = self._reads, {}
+                pins, self._pins = self._pins, {}
+                self._inflight_reads, self._inflight_pins = reads, pins
+            if not reads and not pins:
+                return
+            self.flushes += 1
+            try:
+                for username, pending in reads.items():
+                    try:
+                        await self._write_reads(db, username, pending)
+                        if self.read_progress is not None:
+                            # Множество могло быть загружено из БД до записи —
+                            # после нее оно должно содержать записанное
+                            self.read_progress.apply(
+                                username,
+                                add=[title for title, is_read in pending.items() if is_read],
+                                remove=[title for title, is_read in pending.items() if not is_read],
+                            )
+                        self._publish(username)
+                    except Exception as e:
+                        self._requeue_reads(username, pending, e)
+                for username, title in pins.items():
+                    try:
+                        await self._write_pin(db, username, title)
+                        if self.user_cache is not None:
+                            self.user_cache.update(username, {'pinned_poem_title': title}, publish=False)
+                        self._publish(username)
+                    except Exception as e:
+                        self.failures += 1
+                        print(f"Error flushing pinned poem for {username}: {e}")
+                        with self._lock:
+                            self._pins.setdefault(username, title)
+            finally:
+                with self._lock:
+                    self._inflight_reads, self._inflight_pins = {}, {}
+
+    async def _write_reads(self, db: AsyncDB, username: str, pending: Dict[str, bool]) -> None:
+        marked = [title for title, is_read in pending.items() if is_read]
+        unmarked = [title for title, is_read in pending.items() if not is_read]
+        if marked:
+            rows = [{'username': username, 'poem_title': title} for title in marked]
+            await db.execute(
+                db.table(READ_TABLE).upsert(rows, on_conflict='username,poem_title', ignore_duplicates=True)
+            )
+        if unmarked:
+            await db.execute(db.table(READ_TABLE).delete().eq('username', username).in_('poem_title', unmarked))
+
+    async def _write_pin(self, db: AsyncDB, username: str, title: Optional[str]) -> None:
+        await db.execute(db.table('user').update({'pinned_poem_title': title}).eq('username', username))
+
+    def _publish(self, username: str) -> None:
+        if self.versions is None:
+            return
+        version = self.versions.bump_user(username)
+        for cache in (self.user_cache, self.read_progress, self.summaries):
+            if cache is not None:
+                cache.advance(username, version)
+
+    def _requeue_reads(self, username: str, pending: Dict[str, bool], error: Exception) -> None:
+        self.failures += 1
+        print(f"Error flushing read poems for {username}: {error}")
+        if getattr(error, 'code', None) == FOREIGN_KEY_VIOLATION:
+            # Стих или пользователь удалены — повторять бессмысленно
+            return
+        with self._lock:
+            current = self._reads.setdefault(username, {})
+            for title, is_read in pending.items():
+                # Более новое переключение того же стиха важнее
+                current.setdefault(title, is_read)
+
+    def _schedule(self, db: AsyncDB) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_later(db))
+
+    async def _flush_later(self, db: AsyncDB) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush(db)
+            # Изменения, пришедшие во время записи (или вернувшиеся после
+            # ошибки), уходят в следующем окне
+            with self._lock:
+                if not self._reads and not self._pins:
+                    return
+
+    async def stop(self, db: AsyncDB) -> None:
+        """Записывает очередь сразу и останавливает отложенный сброс."""
+        # Сброс, уже идущий в фоне, не прерывается: flush дождется его по блокировке
+        await self.flush(db)
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending_reads = sum(len(pending) for pending in self._reads.values())
+            pending_pins = len(self._pins)
+        return {
+            "flush_interval": self.flush_interval,
+            "pending_reads": pending_reads,
+            "pending_pins": pending_pins,
+            "flushes": self.flushes,
+            "failures": self.failures,
+        }